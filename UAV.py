@@ -256,9 +256,14 @@
 import numpy as np
 from PyQt6 import QtWidgets
 import pyqtgraph.opengl as gl
-from pyqtgraph.Qt import QtCore
-from triangle3D import Triangle3D
+from OpenGL import GL
+from pyqtgraph.Qt import QtCore, QtGui
+from triangle3D import TriangleFleet
+from trajectory import TrajectoryBuffer, DecimatedTrail, MIN_TRAIL_BUDGET
+import os
+import time
 import random
+from collections import deque
 
 class ColorGenerator:
     def __init__(self):
@@ -284,64 +289,461 @@ class ColorGenerator:
         print("警告：颜色池用尽，使用默认颜色")
         return (0.5, 0.5, 0.5, 1.0)
 
+    def release_color(self, color):
+        """无人机被移除后归还颜色"""
+        self.used_colors.discard(self._color_to_tuple(color))
+
+# 失联无人机的标记颜色
+LOST_COLOR = (0.4, 0.4, 0.4, 1.0)
+# 轨迹点总数超过上限时，超出份额的轨迹截断到份额的这一比例
+TRAIL_TRIM_RATIO = 0.75
+
+class LegendModel(QtCore.QAbstractTableModel):
+    """
+    图例数据模型：接收数据时只修改内部状态，
+    由定时器以较低频率（默认 4 Hz）合并发出变化信号，图例开销与数据包速率无关。
+    设置 sequence_tracker 后，丢包率、乱序数和抖动也在刷新时读取。
+    """
+    COLUMNS = ["IP", "颜色", "电量(%)", "最后接收(s)", "包速率(Hz)", "丢包率(%)", "乱序", "抖动(ms)"]
+
+    def __init__(self, flush_hz=4, parent=None):
+        super().__init__(parent)
+        self.ips = []        # 行号 -> ip
+        self.index_of = {}   # ip -> 行号
+        self.colors = []
+        self.battery = []
+        self.last_seen = []
+        self.rate = []
+        self._packets = []   # 上次刷新以来收到的包数
+        self.loss = []
+        self.reordered = []
+        self.jitter = []
+        self.lost = []       # 是否已失联（整行置灰）
+        self.sequence_tracker = None
+        self._dirty_rows = set()
+        self._pending_rows = []  # 尚未通知视图的新行
+        self._last_flush = time.monotonic()
+
+        self.flush_timer = QtCore.QTimer(self)
+        self.flush_timer.timeout.connect(self.flush)
+        self.flush_timer.start(max(1, round(1000 / flush_hz)))
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.ips) - len(self._pending_rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.ItemDataRole.DisplayRole):
+        if role == QtCore.Qt.ItemDataRole.DisplayRole and orientation == QtCore.Qt.Orientation.Horizontal:
+            return self.COLUMNS[section]
+        return None
+
+    def data(self, index, role=QtCore.Qt.ItemDataRole.DisplayRole):
+        row, col = index.row(), index.column()
+        if role == QtCore.Qt.ItemDataRole.DisplayRole:
+            if col == 0:
+                return self.ips[row]
+            if col == 2:
+                return f"{self.battery[row]:.0f}"
+            if col == 3:
+                return f"{time.monotonic() - self.last_seen[row]:.1f}"
+            if col == 4:
+                return f"{self.rate[row]:.1f}"
+            if col == 5:
+                return "-" if self.loss[row] is None else f"{self.loss[row] * 100:.1f}"
+            if col == 6:
+                return "-" if self.reordered[row] is None else str(self.reordered[row])
+            if col == 7:
+                return "-" if self.jitter[row] is None else f"{self.jitter[row] * 1000:.1f}"
+        elif role == QtCore.Qt.ItemDataRole.BackgroundRole and col == 1:
+            return QtGui.QColor.fromRgbF(*(LOST_COLOR if self.lost[row] else self.colors[row]))
+        elif role == QtCore.Qt.ItemDataRole.ForegroundRole and self.lost[row]:
+            return QtGui.QColor(128, 128, 128)
+        elif role == QtCore.Qt.ItemDataRole.UserRole:
+            # 排序使用原始数值
+            return (self.ips[row], sum(self.colors[row][:3]), self.battery[row],
+                    time.monotonic() - self.last_seen[row], self.rate[row],
+                    self.loss[row] or 0.0, self.reordered[row] or 0, self.jitter[row] or 0.0)[col]
+        return None
+
+    def update_entry(self, ip, color, battery, packets=1):
+        row = self.index_of.get(ip)
+        if row is None:
+            row = len(self.ips)
+            self.index_of[ip] = row
+            self.ips.append(ip)
+            self.colors.append(tuple(color))
+            self.battery.append(battery)
+            self.last_seen.append(time.monotonic())
+            self.rate.append(0.0)
+            self._packets.append(packets)
+            self.loss.append(None)
+            self.reordered.append(None)
+            self.jitter.append(None)
+            self.lost.append(False)
+            self._pending_rows.append(row)
+            return
+        self.battery[row] = battery
+        self.last_seen[row] = time.monotonic()
+        self._packets[row] += packets
+        if self.lost[row]:
+            self.set_lost(ip, False)
+        self._dirty_rows.add(row)
+
+    def set_lost(self, ip, lost):
+        row = self.index_of.get(ip)
+        if row is None or self.lost[row] == lost:
+            return
+        self.lost[row] = lost
+        if row < self.rowCount():
+            self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.COLUMNS) - 1))
+
+    def remove_entry(self, ip):
+        """删除一行；驱逐很少发生，其后各行的行号整体前移 O(n) 即可"""
+        row = self.index_of.get(ip)
+        if row is None:
+            return
+        self._insert_pending()
+        self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+        for column in (self.ips, self.colors, self.battery, self.last_seen, self.rate, self._packets,
+                       self.loss, self.reordered, self.jitter, self.lost):
+            del column[row]
+        # 原地修改，LegendWindow.entries 引用的是同一个字典
+        self.index_of.clear()
+        self.index_of.update((ip, i) for i, ip in enumerate(self.ips))
+        self._dirty_rows = {r if r < row else r - 1 for r in self._dirty_rows if r != row}
+        self.endRemoveRows()
+
+    def _insert_pending(self):
+        """通知视图尚未插入的新行"""
+        if self._pending_rows:
+            first = self._pending_rows[0]
+            last = self._pending_rows[-1]
+            self._pending_rows = []
+            self.beginInsertRows(QtCore.QModelIndex(), first, last)
+            self.endInsertRows()
+
+    def flush(self):
+        now = time.monotonic()
+        dt = max(now - self._last_flush, 1e-3)
+        self._last_flush = now
+        # 包速率做指数平滑，避免数字跳动
+        for row, packets in enumerate(self._packets):
+            self.rate[row] = 0.7 * self.rate[row] + 0.3 * packets / dt
+            self._packets[row] = 0
+        if self.sequence_tracker is not None:
+            for row, ip in enumerate(self.ips):
+                stats = self.sequence_tracker.stats(ip)
+                if stats is not None:
+                    self.loss[row] = stats.loss_rate
+                    self.reordered[row] = stats.reordered
+                    self.jitter[row] = stats.jitter
+
+        self._insert_pending()
+
+        rows = self.rowCount()
+        if rows == 0:
+            return
+        # 电量只在有新数据的行变化；最后接收时间、包速率与序号统计每次刷新都在变化
+        if self._dirty_rows:
+            top, bottom = min(self._dirty_rows), max(self._dirty_rows)
+            self.dataChanged.emit(self.index(top, 2), self.index(bottom, 2))
+            self._dirty_rows.clear()
+        self.dataChanged.emit(self.index(0, 3), self.index(rows - 1, len(self.COLUMNS) - 1))
+
 class LegendWindow(QtWidgets.QWidget):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("无人机状态")
-        self.resize(200, 300)
+        self.resize(640, 300)
         self.layout = QtWidgets.QVBoxLayout(self)
-        self.entries = {}
 
-    def update_entry(self, ip, color, battery):
+        self.model = LegendModel(parent=self)
+        self.proxy = QtCore.QSortFilterProxyModel(self)
+        self.proxy.setSourceModel(self.model)
+        self.proxy.setSortRole(QtCore.Qt.ItemDataRole.UserRole)
+        self.proxy.setDynamicSortFilter(True)
+
+        self.table = QtWidgets.QTableView()
+        self.table.setModel(self.proxy)
+        self.table.setSortingEnabled(True)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectionBehavior.SelectRows)
+        self.layout.addWidget(self.table)
+        self.entries = self.model.index_of
+
+    def update_entry(self, ip, color, battery, packets=1):
         try:
             if not (0 <= battery <= 100):
                 battery = max(0, min(100, battery))
-            if ip in self.entries:
-                label = self.entries[ip]
-                label.setText(f"{ip} | 电量: {battery}%")
-            else:
-                color_box = QtWidgets.QLabel()
-                color_box.setFixedSize(15, 15)
-                color_box.setStyleSheet(
-                    f"background-color: rgba({int(color[0]*255)}, {int(color[1]*255)}, {int(color[2]*255)}, {int(color[3]*255)});"
-                )
-                text = QtWidgets.QLabel(f"{ip} | 电量: {battery}%")
-                row = QtWidgets.QHBoxLayout()
-                row.addWidget(color_box)
-                row.addWidget(text)
-                container = QtWidgets.QWidget()
-                container.setLayout(row)
-                self.layout.addWidget(container)
-                self.entries[ip] = text
+            self.model.update_entry(ip, color, battery, packets)
         except Exception as e:
             print(f"更新图例异常: {e}")
 
+    def set_lost(self, ip, lost):
+        self.model.set_lost(ip, lost)
+
+    def remove_entry(self, ip):
+        self.model.remove_entry(ip)
+
+def _is_compatibility_profile(context):
+    """兼容模式（或 3.1 及以前不区分模式的版本）下点精灵需要单独开启"""
+    sformat = context.format()
+    profile = sformat.profile()
+    if profile == sformat.OpenGLContextProfile.CompatibilityProfile:
+        return True
+    if profile == sformat.OpenGLContextProfile.CoreProfile:
+        return False
+    return sformat.version() < (3, 1) or context.hasExtension(b"GL_ARB_compatibility")
+
+
+class FleetTrailItem(gl.GLScatterPlotItem):
+    """
+    全机队共用的轨迹散点：所有无人机的显示轨迹打包进同一组位置/颜色缓冲区，
+    每架无人机占用一段长度为 slot_size（显示点数预算，不小于 MIN_TRAIL_BUDGET）的槽位，颜色逐顶点存放。
+    只把各槽位新追加的点写入显存，并用一次 glMultiDrawArrays 绘制全部轨迹。
+    """
+    def __init__(self, slot_size, **kwds):
+        super().__init__(**kwds)
+        self.slot_size = max(int(slot_size), MIN_TRAIL_BUDGET)
+        self.trails = []        # 槽位 -> DecimatedTrail，空槽位为 None
+        self.colors = []        # 槽位 -> RGBA
+        self._free_slots = []
+        self._capacity = 0      # 显存中已分配的槽位数
+        self._uploaded = []     # 槽位 -> 已写入显存的点数
+        self._generation = []   # 槽位 -> 显存内容对应的轨迹版本
+        self._color_dirty = set()
+
+    def add_trail(self, trail, color):
+        """登记一条轨迹，返回其槽位编号；轨迹预算超过槽位长度时抛出 ValueError"""
+        if trail.budget > self.slot_size:
+            raise ValueError(f"轨迹预算 {trail.budget} 超过槽位长度 {self.slot_size}")
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self.trails[slot] = trail
+            self.colors[slot] = color
+            self._uploaded[slot] = 0
+            self._generation[slot] = -1
+        else:
+            slot = len(self.trails)
+            self.trails.append(trail)
+            self.colors.append(color)
+            self._uploaded.append(0)
+            self._generation.append(-1)
+        self._color_dirty.add(slot)
+        self.update()
+        return slot
+
+    def remove_trail(self, slot):
+        self.trails[slot] = None
+        self._free_slots.append(slot)
+        self._color_dirty.discard(slot)
+        self.update()
+
+    def _ensure_capacity(self):
+        if self._capacity >= len(self.trails):
+            return
+        # 槽位不足时容量倍增，重新分配后所有槽位需整体重新上传
+        self._capacity = max(8, self._capacity)
+        while self._capacity < len(self.trails):
+            self._capacity *= 2
+        for vbo, width in ((self.m_vbo_position, 3), (self.m_vbo_color, 4)):
+            if not vbo.isCreated():
+                vbo.create()
+            vbo.bind()
+            vbo.allocate(self._capacity * self.slot_size * width * 4)
+            vbo.release()
+        self._generation = [-1] * len(self.trails)
+        self._color_dirty = {slot for slot, trail in enumerate(self.trails) if trail is not None}
+
+    def _upload(self):
+        self._ensure_capacity()
+        vbo = self.m_vbo_position
+        vbo.bind()
+        for slot, trail in enumerate(self.trails):
+            if trail is None:
+                continue
+            count = len(trail)
+            offset = slot * self.slot_size * 12
+            if self._generation[slot] != trail.generation:
+                # 轨迹抽稀重排：整段重新写入
+                points = trail.view()
+                if count > 0:
+                    vbo.write(offset, points, points.nbytes)
+                self._generation[slot] = trail.generation
+            elif count > self._uploaded[slot]:
+                # 只写入新追加的点
+                points = trail.buffer[self._uploaded[slot]:count]
+                vbo.write(offset + self._uploaded[slot] * 12, points, points.nbytes)
+            self._uploaded[slot] = count
+        vbo.release()
+
+        if self._color_dirty:
+            vbo = self.m_vbo_color
+            vbo.bind()
+            for slot in self._color_dirty:
+                block = np.tile(np.array(self.colors[slot], dtype=np.float32), (self.slot_size, 1))
+                vbo.write(slot * self.slot_size * 16, block, block.nbytes)
+            vbo.release()
+            self._color_dirty.clear()
+
+    def paint(self):
+        slots = [slot for slot, trail in enumerate(self.trails) if trail is not None and len(trail) > 0]
+        if not slots:
+            return
+
+        self.setupGLState()
+        self._upload()
+
+        mat_mvp = np.array(self.mvpMatrix().data(), dtype=np.float32)
+        mat_modelview = np.array(self.modelViewMatrix().data(), dtype=np.float32)
+
+        context = QtGui.QOpenGLContext.currentContext()
+        if not context.isOpenGLES():
+            if _is_compatibility_profile(context):
+                GL.glEnable(GL.GL_POINT_SPRITE)
+            GL.glEnable(GL.GL_PROGRAM_POINT_SIZE)
+
+        program = self.getShaderProgram()
+
+        self.m_vbo_position.bind()
+        GL.glVertexAttribPointer(0, 3, GL.GL_FLOAT, False, 0, None)
+        self.m_vbo_position.release()
+        self.m_vbo_color.bind()
+        GL.glVertexAttribPointer(1, 4, GL.GL_FLOAT, False, 0, None)
+        self.m_vbo_color.release()
+        GL.glVertexAttrib1f(2, self.size)
+        GL.glEnableVertexAttribArray(0)
+        GL.glEnableVertexAttribArray(1)
+
+        firsts = np.array(slots, dtype=np.int32) * self.slot_size
+        counts = np.array([len(self.trails[slot]) for slot in slots], dtype=np.int32)
+        with program:
+            GL.glUniformMatrix4fv(GL.glGetUniformLocation(program, "u_mvp"), 1, False, mat_mvp)
+            GL.glUniformMatrix4fv(GL.glGetUniformLocation(program, "u_modelview"), 1, False, mat_modelview)
+            GL.glUniform1f(GL.glGetUniformLocation(program, "u_scale"), 0)
+            GL.glMultiDrawArrays(GL.GL_POINTS, firsts, counts, len(slots))
+
+        GL.glDisableVertexAttribArray(0)
+        GL.glDisableVertexAttribArray(1)
+
+class RenderScheduler(QtCore.QObject):
+    """
+    按目标帧率统一刷新画面：接收数据时只标记脏的无人机，
+    每帧一次性应用所有待更新的状态，没有任何变化的帧直接跳过。
+    """
+    def __init__(self, apply_frame, target_fps=30, parent=None):
+        super().__init__(parent)
+        self.apply_frame = apply_frame
+        self.dirty = set()
+        self.frames = 0    # 实际刷新的帧数
+        self.skipped = 0   # 因无变化跳过的帧数
+        self.frame_times = deque(maxlen=1000)  # 最近各帧的耗时（秒）
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setTimerType(QtCore.Qt.TimerType.PreciseTimer)
+        self.timer.timeout.connect(self._tick)
+        self.set_target_fps(target_fps)
+
+    def set_target_fps(self, fps):
+        self.target_fps = max(float(fps), 1.0)
+        self.timer.start(max(1, round(1000 / self.target_fps)))
+
+    def mark_dirty(self, key):
+        self.dirty.add(key)
+
+    def _tick(self):
+        if not self.dirty:
+            self.skipped += 1
+            return
+        dirty, self.dirty = self.dirty, set()
+        start = time.perf_counter()
+        try:
+            self.apply_frame(dirty)
+        except Exception as e:
+            print(f"刷新画面异常: {e}")
+        self.frame_times.append(time.perf_counter() - start)
+        self.frames += 1
+
 class UAVsingle(QtWidgets.QMainWindow):
-    def __init__(self, ip, color):
+    def __init__(self, ip, color, trail_budget=5000):
         super().__init__()
         self.ip = ip
         self.color = color
         self.view = None
 
-        self.position = np.empty((0, 3))
+        # 全分辨率历史用于导出，显示轨迹按点数预算抽稀
+        self.trajectory = TrajectoryBuffer()
+        self.trail = DecimatedTrail(trail_budget)
         self.direction = np.array([[0, 0, 1]])
         self.theta = 0
         self.battery = 0
+        self.last_update = time.monotonic()
+        self.lost = False  # 超过失联时限未收到数据
 
-        self.scatter = gl.GLScatterPlotItem(size=8.0, color=self.color)
-        self.scatter.setGLOptions('opaque')
-        self.tri = None
-        self.tri_visible = True
+        self.fleet_trail = None
+        self.trail_slot = None
+        self.trail_changed = False  # 上一帧之后显示轨迹是否有新点
+        # 朝向标记在全机队共用标记图元中的实例编号
+        self.markers = None
+        self.marker = None
+
+    @property
+    def position(self):
+        """全部历史坐标（零拷贝视图）"""
+        return self.trajectory.view()
 
     def set_view(self, view):
         self.view = view
 
-    def animate_tri(self, my_rad):
-        if self.tri is not None and self.view is not None:
-            self.theta += np.deg2rad(my_rad)
-            if self.theta > 2 * np.pi:
-                self.theta -= 2 * np.pi
-            self.tri.set_roll(self.theta)
+    def set_fleet_trail(self, fleet_trail):
+        """把显示轨迹登记到全机队共用的轨迹散点中"""
+        self.fleet_trail = fleet_trail
+        self.trail_slot = fleet_trail.add_trail(self.trail, self.color)
+
+    def export_trajectory(self, filepath):
+        """导出全分辨率历史轨迹"""
+        np.savetxt(filepath, self.trajectory.view())
+
+    def advance_roll(self, my_rad):
+        self.theta += np.deg2rad(my_rad)
+        if self.theta > 2 * np.pi:
+            self.theta -= 2 * np.pi
+
+    def set_markers(self, markers):
+        self.markers = markers
+
+    def set_lost(self, lost):
+        """失联时标记置灰，恢复后还原颜色"""
+        self.lost = lost
+        if self.marker is not None:
+            self.markers.set_color(self.marker, LOST_COLOR if lost else self.color)
+
+    def release(self):
+        """归还共用图元中的轨迹槽位和标记"""
+        if self.fleet_trail is not None and self.trail_slot is not None:
+            self.fleet_trail.remove_trail(self.trail_slot)
+            self.trail_slot = None
+        if self.markers is not None and self.marker is not None:
+            self.markers.remove_marker(self.marker)
+            self.marker = None
+
+    def sync_render(self):
+        """把累积的状态变化写入共用图元（每帧调用一次），返回显示轨迹是否有新点"""
+        if self.markers is not None and len(self.trajectory) > 0:
+            current = self.trajectory.last(1)[0]
+            if self.marker is None:
+                self.marker = self.markers.add_marker(current, self.direction[0], self.color, self.theta)
+            else:
+                self.markers.set_position(self.marker, current)
+                self.markers.set_direction(self.marker, self.direction[0])
+                self.markers.set_roll(self.marker, self.theta)
+        trail_changed, self.trail_changed = self.trail_changed, False
+        return trail_changed
 
     def update_data(self, new_position: np.ndarray, new_battery):
         if self.view is None:
@@ -354,26 +756,21 @@ class UAVsingle(QtWidgets.QMainWindow):
             print(f"警告: battery值 {new_battery} 超出合理范围 (0-100)，自动调整")
             new_battery = max(0, min(100, new_battery))
 
-        self.position = np.vstack((self.position, new_position[0]))
+        self.trajectory.append(new_position[0])
         self.battery = new_battery
+        self.last_update = time.monotonic()
+        if self.lost:
+            self.set_lost(False)
 
-        if len(self.position) > 1:
-            self.scatter.setData(pos=self.position[:-1], color=self.color)
-            new_direction = (self.position[-1] - self.position[-2]).reshape(1,3)
+        # 不显示最后一个点，由三角标记表示当前位置
+        if len(self.trajectory) > 1:
+            last_two = self.trajectory.last(2)
+            if self.trail.append(last_two[0]):
+                self.trail_changed = True
+            new_direction = (last_two[1] - last_two[0]).reshape(1, 3)
             if np.linalg.norm(new_direction) > 0.05:
                 self.direction = new_direction
-        else:
-            self.scatter.setData(pos=np.empty((0,3)), color=self.color)
-
-        if self.view is not None:
-            self.view.addItem(self.scatter)
-
-        if self.tri is None:
-            self.tri = Triangle3D(new_position[0], self.direction[0], length=0.3, width=0.2, color=self.color)
-            self.view.addItem(self.tri)
-        else:
-            self.tri.set_position(new_position[0])
-            self.tri.set_direction(self.direction[0])
+        # 图元的更新推迟到下一帧统一进行，见 sync_render
 
 def create_closed_cylinder(radius=0.3, length=1.0, cols=32):
     """
@@ -429,7 +826,8 @@ def create_closed_cylinder(radius=0.3, length=1.0, cols=32):
 
 
 class UAVmonitor(QtWidgets.QMainWindow, ColorGenerator):
-    def __init__(self, computer_pos):
+    def __init__(self, computer_pos, trail_budget=5000, target_fps=30,
+                 lost_after=3.0, evict_after=60.0, max_trail_points=2_000_000):
         super().__init__()
         self.setWindowTitle("UAV航迹监测平台")
         self.resize(800, 800)
@@ -441,6 +839,25 @@ class UAVmonitor(QtWidgets.QMainWindow, ColorGenerator):
         self.view.setCameraPosition(distance=40)
 
         self.uavs = {}
+        self.trail_budget = trail_budget  # 每架无人机显示轨迹的最大点数
+        # 超过 lost_after 秒未收到数据显示为失联，超过 evict_after 秒移除（<= 0 表示不移除）
+        self.lost_after = lost_after
+        self.evict_after = evict_after
+        # 所有无人机保留的全分辨率轨迹点总数上限
+        self.max_trail_points = max_trail_points
+        self.sequence_tracker = None
+
+        # 所有无人机的轨迹共用一个散点图元，只添加一次
+        self.fleet_trail = FleetTrailItem(trail_budget, size=8.0)
+        self.fleet_trail.setGLOptions('opaque')
+        self.view.addItem(self.fleet_trail)
+
+        # 所有无人机的朝向标记共用一个图元
+        self.markers = TriangleFleet(length=0.3, width=0.2, auto_refresh=False)
+        self.view.addItem(self.markers)
+
+        # 接收数据时只标记脏的无人机，按目标帧率统一刷新
+        self.scheduler = RenderScheduler(self._apply_frame, target_fps, self)
 
         self._add_axes()
         self._add_grid()
@@ -453,6 +870,64 @@ class UAVmonitor(QtWidgets.QMainWindow, ColorGenerator):
         self.flash_timer.timeout.connect(self.animate_all_tris)
         self.flash_timer.start(500)
 
+        self.stale_timer = QtCore.QTimer()
+        self.stale_timer.timeout.connect(self.check_stale)
+        self.stale_timer.start(1000)
+
+        # Ctrl+S 导出所有无人机的全分辨率轨迹
+        self.export_shortcut = QtGui.QShortcut(QtGui.QKeySequence("Ctrl+S"), self)
+        self.export_shortcut.activated.connect(self.export_trajectories)
+
+    def set_sequence_tracker(self, tracker):
+        """图例显示该跟踪器统计的丢包率、乱序数和抖动"""
+        self.sequence_tracker = tracker
+        self.legend.model.sequence_tracker = tracker
+
+    def check_stale(self):
+        """每秒检查一次：超时的无人机先置灰，再移除；并执行全局轨迹点数上限"""
+        now = time.monotonic()
+        try:
+            for ip, uav in list(self.uavs.items()):
+                age = now - uav.last_update
+                if self.evict_after > 0 and age > self.evict_after:
+                    self.evict_uav(ip)
+                elif age > self.lost_after and not uav.lost:
+                    uav.set_lost(True)
+                    self.legend.set_lost(ip, True)
+                    self.scheduler.mark_dirty(ip)
+            self.enforce_trail_cap()
+        except Exception as e:
+            print(f"清理失联无人机异常: {e}")
+
+    def evict_uav(self, ip):
+        """移除一架无人机，释放其图元资源、图例行和颜色"""
+        uav = self.uavs.pop(ip, None)
+        if uav is None:
+            return
+        uav.release()
+        self.legend.remove_entry(ip)
+        self.color_generator.release_color(uav.color)
+        if self.sequence_tracker is not None:
+            self.sequence_tracker.forget(ip)
+        # 保证下一帧执行，重建已删除标记后的网格
+        self.scheduler.mark_dirty(ip)
+        print(f"无人机 {ip} 超过 {self.evict_after:.0f} 秒未收到数据，已移除")
+
+    def enforce_trail_cap(self):
+        """
+        保留的轨迹点总数超过上限时，把超出平均份额的无人机截断到份额的 TRAIL_TRIM_RATIO，
+        留出余量，避免之后每秒都在上限附近反复截断
+        """
+        if not self.uavs:
+            return
+        total = sum(len(uav.trajectory) for uav in self.uavs.values())
+        if total <= self.max_trail_points:
+            return
+        share = self.max_trail_points // len(self.uavs)
+        for uav in self.uavs.values():
+            if len(uav.trajectory) > share:
+                uav.trajectory.trim(int(share * TRAIL_TRIM_RATIO))
+
     def _add_localhost_model(self, position: np.ndarray):
         cyl_mesh = create_closed_cylinder(radius=0.3, length=1, cols=32)
         cylinder = gl.GLMeshItem(meshdata=cyl_mesh, smooth=True, color=(1, 1, 0, 1), shader="shaded", drawFaces=True)
@@ -461,11 +936,28 @@ class UAVmonitor(QtWidgets.QMainWindow, ColorGenerator):
         self.view.addItem(cylinder)
 
     def animate_all_tris(self):
-        for uav in self.uavs.values():
-            try:
-                uav.animate_tri(30)
-            except Exception as e:
-                print(f"动画异常: {e}")
+        # 只推进滚转角并标记，变换矩阵在下一帧与其他变化一起批量计算
+        try:
+            for ip, uav in self.uavs.items():
+                if uav.marker is not None:
+                    uav.advance_roll(30)
+                    self.scheduler.mark_dirty(ip)
+        except Exception as e:
+            print(f"动画异常: {e}")
+
+    def _apply_frame(self, dirty):
+        """每帧调用一次：应用所有脏无人机的状态，并只重建一次标记、刷新一次轨迹"""
+        trails_changed = False
+        for ip in dirty:
+            uav = self.uavs.get(ip)
+            if uav is None:
+                continue
+            if uav.sync_render():
+                trails_changed = True
+        if self.markers.dirty:
+            self.markers.refresh()
+        if trails_changed:
+            self.fleet_trail.update()
 
     def _add_axes(self):
         axis_length = 10
@@ -499,19 +991,33 @@ class UAVmonitor(QtWidgets.QMainWindow, ColorGenerator):
         )
         self.view.addItem(grid)
 
-    def update_uav(self, ip, pos: np.ndarray, battery):
+    def update_uav(self, ip, pos: np.ndarray, battery, packets=1):
         try:
             if ip in self.uavs:
                 self.uavs[ip].update_data(pos, battery)
             else:
                 color = self.color_generator.get_unique_color()
-                self.uavs[ip] = UAVsingle(ip, color)
+                self.uavs[ip] = UAVsingle(ip, color, self.trail_budget)
                 self.uavs[ip].set_view(self.view)
+                self.uavs[ip].set_fleet_trail(self.fleet_trail)
+                self.uavs[ip].set_markers(self.markers)
                 self.uavs[ip].update_data(pos, battery)
-            self.legend.update_entry(ip, self.uavs[ip].color, battery)
+            self.legend.update_entry(ip, self.uavs[ip].color, self.uavs[ip].battery, packets)
+            self.scheduler.mark_dirty(ip)
         except Exception as e:
             print(f"更新无人机数据异常: {e}")
 
+    def export_trajectories(self, out_dir="./trajectory"):
+        """导出所有无人机的全分辨率轨迹，每架无人机一个文本文件"""
+        os.makedirs(out_dir, exist_ok=True)
+        for ip, uav in self.uavs.items():
+            filepath = os.path.join(out_dir, f"{ip}.txt")
+            try:
+                uav.export_trajectory(filepath)
+                print(f"已导出轨迹: {filepath}（{len(uav.trajectory)} 个点）")
+            except Exception as e:
+                print(f"导出轨迹失败: {e}")
+
 # if __name__ == "__main__":
 #     app = QtWidgets.QApplication(sys.argv)
 #     window = UAVmonitor()
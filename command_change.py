@@ -1,14 +1,32 @@
 import os
+import re
 import time
+import ctypes
+import ctypes.util
+import queue
+import struct
+import argparse
+import threading
 import xml.etree.ElementTree as ET
 import multi_point_fly
+from command_common import parse_targets
+from command_ipc import COMMAND_SOCKET, CommandListener
 
 # 设置扫描的文件夹路径
 folder_path = './commands_xml'
 
-# 设置扫描的时间间隔（秒）
+# 设置扫描的时间间隔（秒），仅在 inotify 不可用时轮询使用
 scan_interval = 5
 
+# inotify 常量（见 <sys/inotify.h>），只关心原子重命名得到的 .xml 文件
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+# xml_file.save_command_to_xml 生成的文件名以序号开头：{序号}_{指令}_{时间}.xml
+SEQUENCE_PATTERN = re.compile(r"^(\d+)_")
+
 def read_xml_file(file_path):
     """读取并解析 XML 文件并输出命令格式"""
     try:
@@ -36,30 +54,139 @@ def read_xml_file(file_path):
     except Exception as e:
         print(f"读取 {file_path} 时发生错误：{e}")
 
-def scan_folder():
+def execute_command(command, para):
+    """执行一条指令；para 可以是 XML 中的字符串，也可以是本地通道传来的数值"""
+    if command == "back":
+        multi_point_fly.execute_back(float(para["alt"]))
+    if command == "follow":
+        ip_list = parse_targets(para["follow_ip"])
+        multi_point_fly.execute_follow(ip_list, float(para["alt"]))
+
+def sequence_key(filename):
+    """按文件名中的序号排序；不带序号的旧文件名排在前面，按名称排序"""
+    match = SEQUENCE_PATTERN.match(filename)
+    return (1, int(match.group(1)), filename) if match else (0, 0, filename)
+
+def process_files(filenames, handle=execute_command):
+    """按序号依次处理 XML 指令文件，处理前改名为 .finish，避免重复执行；handle(command, para) 负责执行"""
+    for filename in sorted(filenames, key=sequence_key):
+        file_path = os.path.join(folder_path, filename)
+
+        # 检查是否为 XML 文件
+        if filename.endswith('.xml') and os.path.isfile(file_path):
+            print(f"发现 XML 文件: {filename}")
+            result = read_xml_file(file_path)
+            new_filepath = file_path + ".finish"
+            os.rename(file_path, new_filepath)
+
+            if result is not None:
+                handle(*result)
+
+def scan_folder(handle=execute_command):
     """定时扫描文件夹并读取 XML 文件"""
     while True:
         print("开始扫描文件夹...")
-        
-        # 获取文件夹中的所有文件
-        for filename in os.listdir(folder_path):
-            file_path = os.path.join(folder_path, filename)
-            
-            # 检查是否为 XML 文件
-            if filename.endswith('.xml') and os.path.isfile(file_path):
-                print(f"发现 XML 文件: {filename}")
-                command, para = read_xml_file(file_path)
-                new_filepath = file_path + ".finish"
-                os.rename(file_path, new_filepath)
-
-                if command == "back":
-                    multi_point_fly.execute_back(float(para["alt"]))
-                if command == "follow":
-                    ip_list = [ip.strip("[]") for ip in para["follow_ip"].split(", ")]
-                    multi_point_fly.execute_follow(ip_list, float(para["alt"]))
-        
+        process_files(os.listdir(folder_path), handle)
+
         # 等待下次扫描
         time.sleep(scan_interval)
 
+def _inotify_watch(path):
+    """为 path 创建 inotify 监视，返回文件描述符；系统不支持时返回 None"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, os.fsencode(path), IN_MOVED_TO) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+def _read_events(fd):
+    """阻塞读取一批 inotify 事件，返回 (文件名列表, 是否发生队列溢出)"""
+    data = os.read(fd, 64 * 1024)
+    names = []
+    overflow = False
+    offset = 0
+    while offset < len(data):
+        _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+        name = data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b"\0")
+        offset += INOTIFY_EVENT.size + length
+        if mask & IN_Q_OVERFLOW:
+            overflow = True
+        elif name:
+            names.append(os.fsdecode(name))
+    return names, overflow
+
+def watch_folder(handle=execute_command):
+    """
+    用 inotify 等待 XML 文件被重命名到文件夹中，到达后立即按序号处理，空闲时不占用 CPU；
+    inotify 不可用时退回定时扫描
+    """
+    os.makedirs(folder_path, exist_ok=True)
+    fd = _inotify_watch(folder_path)
+    if fd is None:
+        print(f"inotify 不可用，改为每 {scan_interval} 秒扫描一次文件夹")
+        scan_folder(handle)
+        return
+    print(f"开始监视文件夹 {folder_path}")
+    try:
+        # 先处理监视建立之前已经存在的文件
+        process_files(os.listdir(folder_path), handle)
+        while True:
+            names, overflow = _read_events(fd)
+            # 事件队列溢出时可能漏掉文件，重新扫描整个文件夹
+            process_files(os.listdir(folder_path) if overflow else names, handle)
+    finally:
+        os.close(fd)
+
+def _receive_ipc(listener, commands):
+    """后台线程：把本地通道收到的指令放入执行队列，无效的数据报丢弃"""
+    while True:
+        try:
+            message = listener.receive()
+            commands.put((message["name"], message.get("params") or {}))
+        except OSError:
+            # 通道已关闭
+            return
+        except Exception as e:
+            print(f"本地通道收到无效指令：{e}")
+
+def serve(path=COMMAND_SOCKET):
+    """
+    从本地指令通道接收 receive_command 交付的指令，同时在后台监视文件夹，
+    处理本地通道不可用时写下的 XML 指令。两路指令进入同一个队列，由主线程逐条执行，
+    同一时刻只有一条指令在控制飞控
+    """
+    os.makedirs(folder_path, exist_ok=True)
+    listener = CommandListener(path)
+    print(f"本地指令通道 {path} 已就绪")
+    commands = queue.Queue()
+    threading.Thread(target=_receive_ipc, args=(listener, commands), daemon=True, name="ReceiveIPC").start()
+    threading.Thread(target=watch_folder, args=(lambda command, para: commands.put((command, para)),),
+                     daemon=True, name="WatchFolder").start()
+    try:
+        while True:
+            command, para = commands.get()
+            print(f"执行指令: {command} {para}")
+            try:
+                execute_command(command, para)
+            except Exception as e:
+                print(f"执行指令 {command} 时发生错误：{e}")
+    except KeyboardInterrupt:
+        print("\n执行端已退出")
+    finally:
+        listener.close()
+
 if __name__ == '__main__':
-    scan_folder()
+    parser = argparse.ArgumentParser(description="机载指令执行端")
+    parser.add_argument("--ipc", default=COMMAND_SOCKET, help=f"本地指令通道，默认{COMMAND_SOCKET}，传空字符串表示只监视XML文件夹")
+    args = parser.parse_args()
+
+    if args.ipc:
+        serve(args.ipc)
+    else:
+        watch_folder()
@@ -0,0 +1,136 @@
+import re
+import json
+import struct
+import socket
+
+# 二进制指令格式：
+#   头部 "UC" + 版本号 + 指令编号 + 标志 + 字段数 + 指令 id（3 字节会话号 + 4 字节计数）
+#   之后是若干字段：字段编号 u1、类型 u1、元素个数 u2、
+#   数据（小端 float32 / float64 数组、网络序 IPv4 数组或原始字节）
+# 坐标（x、y、z、path）用 float64，与 JSON 一样精确；高度与时间间隔用 float32，
+# 解码后保留 7 位有效数字（如 12.3456789 变为 12.34568），对米和秒而言足够
+# 首字节不是 "U" 的数据报按 JSON 解析，兼容旧的发送端
+MAGIC = b"UC"
+CODEC_VERSION = 2
+HEADER = struct.Struct("<2sBBBB3sI")
+FIELD = struct.Struct("<BBH")
+FLAG_HAS_ID = 0x01
+
+# 机载端接收缓冲区：容纳一个完整的 UDP 数据报，长路径的 go 指令不会被截断
+MAX_COMMAND_SIZE = 65535
+
+COMMAND_CODES = {"start": 1, "back": 2, "follow": 3, "release": 4, "go": 5, "land": 6, "flytopoint": 7}
+COMMAND_NAMES = {code: name for name, code in COMMAND_CODES.items()}
+
+TYPE_F32, TYPE_IPV4, TYPE_BYTES, TYPE_F64 = 0, 1, 2, 3
+# 字段编号 -> (名称, 类型, 是否为标量)；targets 与 roster 在指令顶层，其余在 params 中
+FIELDS = {
+    1: ("ip", TYPE_IPV4, True),
+    2: ("alt", TYPE_F32, True),
+    3: ("interval", TYPE_F32, True),
+    4: ("x", TYPE_F64, True),
+    5: ("y", TYPE_F64, True),
+    6: ("z", TYPE_F64, True),
+    7: ("path", TYPE_F64, False),
+    8: ("follow_ip", TYPE_IPV4, False),
+    9: ("targets", TYPE_IPV4, False),
+    10: ("roster_base", TYPE_IPV4, True),
+    11: ("roster_bits", TYPE_BYTES, False),
+}
+FIELD_CODES = {name: code for code, (name, _, _) in FIELDS.items()}
+TOP_LEVEL_FIELDS = ("targets", "roster_base", "roster_bits")
+# 这些 ip 列表在 JSON 中是以 ", " 连接的字符串
+JOINED_FIELDS = ("follow_ip",)
+
+_ID_PATTERN = re.compile(r"^([0-9a-f]{6})-(\d+)$")
+
+
+def _pack_field(name, value):
+    code = FIELD_CODES[name]
+    _, kind, scalar = FIELDS[code]
+    if name in JOINED_FIELDS:
+        value = [item for item in re.split(r"[\s,]+", value) if item]
+    values = [value] if scalar else list(value)
+    if kind == TYPE_F32:
+        data = struct.pack(f"<{len(values)}f", *(float(v) for v in values))
+    elif kind == TYPE_F64:
+        data = struct.pack(f"<{len(values)}d", *(float(v) for v in values))
+    elif kind == TYPE_IPV4:
+        data = b"".join(socket.inet_aton(v) for v in values)
+    else:
+        data = bytes(value)
+        values = data
+    return FIELD.pack(code, kind, len(values)) + data
+
+
+def encode_command(message):
+    """
+    把指令（{"name", "params", "id", 可选 "targets"/"roster"}）编码为二进制；
+    含有二进制格式无法表示的内容（未知指令或参数、非数值参数等）时返回 JSON 编码
+    """
+    try:
+        command_id = message.get("id")
+        session, counter, flags = b"\0\0\0", 0, 0
+        if command_id is not None:
+            match = _ID_PATTERN.match(command_id)
+            session, counter, flags = bytes.fromhex(match.group(1)), int(match.group(2)), FLAG_HAS_ID
+        fields = dict(message.get("params") or {})
+        if "targets" in message:
+            fields["targets"] = message["targets"]
+        if "roster" in message:
+            bits = int(message["roster"]["bits"], 16)
+            fields["roster_base"] = message["roster"]["base"]
+            fields["roster_bits"] = bits.to_bytes((bits.bit_length() + 7) // 8 or 1, "little")
+        body = b"".join(_pack_field(name, value) for name, value in fields.items())
+        header = HEADER.pack(MAGIC, CODEC_VERSION, COMMAND_CODES[message["name"]], flags, len(fields), session, counter)
+        return header + body
+    except (KeyError, AttributeError, TypeError, ValueError, OSError, struct.error, OverflowError):
+        return json.dumps(message).encode()
+
+
+def _short_float(value):
+    """float32 还原为最短的十进制表示，XML 中不出现 1.2000000476837158 这种尾数"""
+    return float(f"{value:.7g}")
+
+
+def decode_command(data):
+    """
+    解析机载端收到的指令数据报，返回与 JSON 格式相同的 dict。
+    二进制格式按固定偏移直接取值；版本不支持时抛出 ValueError，JSON 无效时抛出 json.JSONDecodeError
+    """
+    if data[:2] != MAGIC:
+        return json.loads(data.decode())
+    _, version, opcode, flags, count, session, counter = HEADER.unpack_from(data)
+    if version != CODEC_VERSION:
+        raise ValueError(f"不支持的指令编码版本 {version}")
+    params = {}
+    message = {"name": COMMAND_NAMES[opcode], "params": params,
+               "id": f"{session.hex()}-{counter}" if flags & FLAG_HAS_ID else None}
+    offset = HEADER.size
+    for _ in range(count):
+        code, kind, n = FIELD.unpack_from(data, offset)
+        offset += FIELD.size
+        name, _, scalar = FIELDS[code]
+        if kind == TYPE_F32:
+            values = [_short_float(v) for v in struct.unpack_from(f"<{n}f", data, offset)]
+            offset += 4 * n
+        elif kind == TYPE_F64:
+            values = list(struct.unpack_from(f"<{n}d", data, offset))
+            offset += 8 * n
+        elif kind == TYPE_IPV4:
+            values = [socket.inet_ntoa(data[offset + 4 * i:offset + 4 * i + 4]) for i in range(n)]
+            offset += 4 * n
+        else:
+            values = data[offset:offset + n]
+            offset += n
+        value = values[0] if scalar else values
+        if name in JOINED_FIELDS:
+            value = ", ".join(value)
+        if name in TOP_LEVEL_FIELDS:
+            message[name] = value
+        else:
+            params[name] = value
+    if "roster_base" in message:
+        bits = int.from_bytes(message.pop("roster_bits"), "little")
+        message["roster"] = {"base": message.pop("roster_base"), "bits": format(bits, "x")}
+    return message
@@ -0,0 +1,72 @@
+import re
+import json
+import ipaddress
+
+# 地面端与机载端共用的指令定义，只依赖标准库，机载端导入时不会带入分发器与定时发送队列
+
+# 组播指令通道：一个数据报发给全部机载端，机载端按数据报中的目标集合决定是否执行
+COMMAND_GROUP = "239.255.99.1"
+# 目标集合地址跨度不超过该值时可以用位图表示
+MAX_ROSTER_SPAN = 4096
+
+
+def parse_targets(ip):
+    """
+    把 ip 参数规范化为去重后的 ip 列表。
+    接受列表/元组，或任意以逗号、空格分隔的字符串（包括 "['a', 'b']" 这种列表文本）
+    """
+    if isinstance(ip, str):
+        items = re.split(r"[\s,;\[\]'\"]+", ip)
+    else:
+        items = [str(item).strip() for item in ip]
+    targets = []
+    for item in items:
+        if not item:
+            continue
+        try:
+            ipaddress.IPv4Address(item)
+        except ValueError:
+            raise ValueError(f"无效的无人机ip：{item}")
+        if item not in targets:
+            targets.append(item)
+    if not targets:
+        raise ValueError("请指定接收命令的无人机ip！")
+    return targets
+
+
+def encode_target_set(targets):
+    """
+    把目标 ip 列表编码为紧凑的目标集合，取较短者：
+    {"targets": [ip, ...]} 显式列表，或 {"roster": {"base": 起始ip, "bits": 十六进制位图}}，
+    位图第 i 位表示 base + i 是否为目标
+    """
+    explicit = {"targets": list(targets)}
+    numbers = [int(ipaddress.IPv4Address(ip)) for ip in targets]
+    base = min(numbers)
+    if max(numbers) - base >= MAX_ROSTER_SPAN:
+        return explicit
+    bits = 0
+    for number in numbers:
+        bits |= 1 << (number - base)
+    roster = {"roster": {"base": str(ipaddress.IPv4Address(base)), "bits": format(bits, "x")}}
+    return roster if len(json.dumps(roster)) < len(json.dumps(explicit)) else explicit
+
+
+def in_target_set(command, ip):
+    """机载端判断指令是否发给自己；不带目标集合的（单播）指令总是执行"""
+    if "targets" in command:
+        return ip in command["targets"]
+    if "roster" in command:
+        offset = int(ipaddress.IPv4Address(ip)) - int(ipaddress.IPv4Address(command["roster"]["base"]))
+        return offset >= 0 and (int(command["roster"]["bits"], 16) >> offset) & 1 == 1
+    return True
+
+
+def copy_result(source, target):
+    """把 source 的结果（或异常、取消状态）转交给 target"""
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
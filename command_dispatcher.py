@@ -0,0 +1,300 @@
+import os
+import time
+import json
+import socket
+import asyncio
+import atexit
+import itertools
+import threading
+import concurrent.futures
+from dataclasses import dataclass
+from command_codec import encode_command
+from command_common import COMMAND_GROUP, encode_target_set, copy_result
+
+# 指令默认发送端口，与 receive_command.listening 一致
+COMMAND_PORT = 9999
+# 重传：首次等待 RETRANSMIT_INITIAL 秒，之后每次加倍，最长 RETRANSMIT_MAX_INTERVAL 秒；
+# 超过 DELIVERY_TIMEOUT 秒仍未收到确认则放弃
+RETRANSMIT_INITIAL = 0.2
+RETRANSMIT_MAX_INTERVAL = 1.0
+DELIVERY_TIMEOUT = 3.0
+# 机载端的确认消息：message command reached <id> [<ip>]（旧版机载端不带 id）
+ACK_PREFIX = "message command reached"
+MULTICAST_TTL = 1  # 组播指令只在本网段内传播
+# 指令编码：json 兼容所有机载端；binary 为紧凑的二进制格式，只有新版 receive_command.py 能解析，
+# 旧机载端收到后不会确认，指令会在重传后超时。确认全机队已更新后再用 get_dispatcher(codec="binary") 切换
+DEFAULT_CODEC = "json"
+CODECS = ("json", "binary")
+
+
+@dataclass
+class DispatchOutcome:
+    """一条指令发往一架无人机的送达结果"""
+    ip: str
+    name: str
+    status: str          # acked 已确认，timeout 超时未确认，failed 发送失败
+    sent_at: float
+    error: str = None
+    command_id: str = None
+    rtt: float = None    # 最后一次发送到收到确认的时间（秒）
+    attempts: int = 1    # 发送次数（含重传）
+
+
+class _Pending:
+    __slots__ = ("future", "name", "data", "addr", "first_sent", "last_sent", "attempts", "interval", "timer")
+
+    def __init__(self, future, name, data, addr):
+        self.future = future
+        self.name = name
+        self.data = data
+        self.addr = addr
+        self.first_sent = self.last_sent = time.monotonic()
+        self.attempts = 1
+        self.interval = RETRANSMIT_INITIAL
+        self.timer = None
+
+
+class _MulticastGroup:
+    """一次组播发送：各目标的待确认项共用一个重传定时器，重传时只带上尚未确认的目标"""
+    __slots__ = ("command", "command_id", "targets", "addr", "first_sent", "interval")
+
+    def __init__(self, command, command_id, targets, addr):
+        self.command = command
+        self.command_id = command_id
+        self.targets = targets
+        self.addr = addr
+        self.first_sent = time.monotonic()
+        self.interval = RETRANSMIT_INITIAL
+
+
+class _DispatchProtocol(asyncio.DatagramProtocol):
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+
+    def datagram_received(self, data, addr):
+        self.dispatcher.on_reply(data, addr)
+
+    def error_received(self, exc):
+        print(f"指令发送异常: {exc}")
+
+
+class CommandDispatcher:
+    """
+    长期存在的异步指令分发器：只持有一个 UDP socket，
+    一条指令同时发往任意多架无人机，为每架无人机返回一个 Future（结果为 DispatchOutcome）。
+    每条指令带唯一 id 并登记在待确认表中，未确认的按退避间隔重传，
+    所有目标的确认并发收集，超过 timeout 秒仍未确认的以 timeout 结束。
+    所有方法都必须在事件循环所在线程中调用；同步代码请使用 BackgroundDispatcher。
+    """
+    def __init__(self, port=COMMAND_PORT, timeout=DELIVERY_TIMEOUT, codec=DEFAULT_CODEC):
+        self.port = port
+        self.timeout = timeout
+        self.codec = codec
+        self.transport = None
+        self._pending = {}  # (ip, 指令 id) -> _Pending
+        self._session = os.urandom(3).hex()
+        self._counter = itertools.count(1)
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: _DispatchProtocol(self), local_addr=("0.0.0.0", 0), family=socket.AF_INET)
+        sock = self.transport.get_extra_info("socket")
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, MULTICAST_TTL)
+        return self
+
+    def dispatch(self, command, targets, port=None):
+        """把指令发往 targets 中的每个 ip，返回 {ip: asyncio.Future}"""
+        loop = asyncio.get_running_loop()
+        port = port or self.port
+        command_id = f"{self._session}-{next(self._counter)}"
+        futures = {}
+        for ip in targets:
+            future = loop.create_future()
+            futures[ip] = future
+            entry = _Pending(future, command.name, self.encode(command, ip, command_id), (ip, port))
+            key = (ip, command_id)
+            try:
+                self.transport.sendto(entry.data, entry.addr)
+            except Exception as e:
+                future.set_result(DispatchOutcome(ip, command.name, "failed", entry.first_sent, str(e), command_id))
+                continue
+            self._pending[key] = entry
+            entry.timer = loop.call_later(entry.interval, self._retransmit, key)
+        return futures
+
+    def multicast(self, command, targets, port=None, group=COMMAND_GROUP):
+        """
+        用一个组播数据报把指令发给 targets 中的全部无人机，返回 {ip: asyncio.Future}；
+        确认仍按 (ip, 指令 id) 单独收集，未确认的目标由组播重传覆盖
+        """
+        loop = asyncio.get_running_loop()
+        command_id = f"{self._session}-{next(self._counter)}"
+        batch = _MulticastGroup(command, command_id, list(targets), (group, port or self.port))
+        data = self.encode_multicast(command, batch.targets, command_id)
+        futures = {}
+        for ip in batch.targets:
+            futures[ip] = loop.create_future()
+            self._pending[(ip, command_id)] = _Pending(futures[ip], command.name, data, batch.addr)
+        try:
+            self.transport.sendto(data, batch.addr)
+        except Exception as e:
+            for ip in batch.targets:
+                self._finish((ip, command_id), "failed", str(e))
+            return futures
+        loop.call_later(batch.interval, self._retransmit_multicast, batch)
+        return futures
+
+    def encode_multicast(self, command, targets, command_id):
+        """组播指令的参数中不带 ip，由机载端填入自己的 ip"""
+        message = type(command)(command.name, dict(command.params or {}), command_id).to_dict()
+        message.update(encode_target_set(targets))
+        return self._serialize(message)
+
+    def _retransmit_multicast(self, batch):
+        keys = [(ip, batch.command_id) for ip in batch.targets if (ip, batch.command_id) in self._pending]
+        if not keys:
+            return
+        now = time.monotonic()
+        remaining = self.timeout - (now - batch.first_sent)
+        if remaining <= 0:
+            for key in keys:
+                self._finish(key, "timeout")
+            return
+        data = self.encode_multicast(batch.command, [ip for ip, _ in keys], batch.command_id)
+        try:
+            self.transport.sendto(data, batch.addr)
+        except Exception as e:
+            for key in keys:
+                self._finish(key, "failed", str(e))
+            return
+        for key in keys:
+            entry = self._pending[key]
+            entry.last_sent = now
+            entry.attempts += 1
+        batch.interval = min(batch.interval * 2, RETRANSMIT_MAX_INTERVAL)
+        asyncio.get_running_loop().call_later(min(batch.interval, remaining), self._retransmit_multicast, batch)
+
+    def encode(self, command, ip, command_id=None):
+        """编码发给某架无人机的指令（参数中带上该无人机的 ip，与机载端保存的 XML 一致）"""
+        params = dict(command.params or {})
+        params["ip"] = ip
+        return self._serialize(type(command)(command.name, params, command_id).to_dict())
+
+    def _serialize(self, message):
+        return encode_command(message) if self.codec == "binary" else json.dumps(message).encode()
+
+    def _retransmit(self, key):
+        entry = self._pending.get(key)
+        if entry is None:
+            return
+        now = time.monotonic()
+        remaining = self.timeout - (now - entry.first_sent)
+        if remaining <= 0:
+            self._finish(key, "timeout")
+            return
+        try:
+            self.transport.sendto(entry.data, entry.addr)
+        except Exception as e:
+            self._finish(key, "failed", str(e))
+            return
+        entry.last_sent = now
+        entry.attempts += 1
+        entry.interval = min(entry.interval * 2, RETRANSMIT_MAX_INTERVAL)
+        entry.timer = asyncio.get_running_loop().call_later(min(entry.interval, remaining), self._retransmit, key)
+
+    def _finish(self, key, status, error=None):
+        entry = self._pending.pop(key)
+        if entry.timer is not None:
+            entry.timer.cancel()
+        rtt = time.monotonic() - entry.last_sent if status == "acked" else None
+        if not entry.future.done():
+            entry.future.set_result(DispatchOutcome(key[0], entry.name, status, entry.first_sent, error,
+                                                    key[1], rtt, entry.attempts))
+
+    def send_raw(self, data, targets, port=None):
+        """发送原始数据（如 message 消息）"""
+        for ip in targets:
+            self.transport.sendto(data, (ip, port or self.port))
+
+    def on_reply(self, data, addr):
+        """收到无人机的确认：按 (ip, 指令 id) 结束对应的待确认项"""
+        text = data.decode(errors="ignore")
+        if not text.startswith(ACK_PREFIX):
+            return
+        fields = text[len(ACK_PREFIX):].split()
+        command_id = fields[0] if fields else ""
+        # 组播指令的确认带有机载端自己的 ip
+        key = (fields[1] if len(fields) > 1 else addr[0], command_id)
+        if not command_id:
+            # 旧版机载端不带 id：确认该无人机最早的一条待确认指令
+            key = next((k for k in self._pending if k[0] == addr[0]), None)
+        if key in self._pending:
+            self._finish(key, "acked")
+
+    def close(self):
+        for key in list(self._pending):
+            self._finish(key, "failed", "分发器已关闭")
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+
+class BackgroundDispatcher:
+    """
+    在后台线程中运行事件循环和 CommandDispatcher，供控制台等同步代码使用：
+    submit 立即返回 {ip: concurrent.futures.Future}，不等待发送完成。
+    """
+    def __init__(self, port=COMMAND_PORT, codec=DEFAULT_CODEC):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True, name="CommandDispatcher")
+        self.thread.start()
+        self.dispatcher = asyncio.run_coroutine_threadsafe(
+            CommandDispatcher(port, codec=codec).start(), self.loop).result()
+
+    @property
+    def codec(self):
+        return self.dispatcher.codec
+
+    @codec.setter
+    def codec(self, codec):
+        self.loop.call_soon_threadsafe(setattr, self.dispatcher, "codec", codec)
+
+    def submit(self, command, targets, port=None, multicast=False):
+        futures = {ip: concurrent.futures.Future() for ip in targets}
+        send = self.dispatcher.multicast if multicast else self.dispatcher.dispatch
+
+        def run():
+            for ip, future in send(command, targets, port).items():
+                future.add_done_callback(lambda f, target=futures[ip]: copy_result(f, target))
+
+        self.loop.call_soon_threadsafe(run)
+        return futures
+
+    def send_raw(self, data, targets, port=None):
+        self.loop.call_soon_threadsafe(self.dispatcher.send_raw, data, list(targets), port)
+
+    def close(self):
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.dispatcher.close)
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(1.0)
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher(codec=None):
+    """进程内共用的后台分发器，首次调用时创建，退出时关闭；codec 不为 None 时切换之后指令的编码"""
+    global _dispatcher
+    if codec is not None and codec not in CODECS:
+        raise ValueError(f"不支持的指令编码 {codec!r}，可选 {', '.join(CODECS)}")
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = BackgroundDispatcher(codec=codec or DEFAULT_CODEC)
+            atexit.register(_dispatcher.close)
+        elif codec is not None:
+            _dispatcher.codec = codec
+        return _dispatcher
@@ -0,0 +1,52 @@
+import os
+import json
+import socket
+from command_codec import MAX_COMMAND_SIZE
+
+# 机载端 receive_command 与 command_change 之间的本地指令通道（Unix 数据报 socket）
+COMMAND_SOCKET = os.environ.get("UAV_COMMAND_SOCKET", "/tmp/uav_command.sock")
+
+
+class CommandChannel:
+    """接收端使用：把解析好的指令直接交给执行端，执行端未启动或来不及处理时返回 False"""
+    def __init__(self, path=COMMAND_SOCKET):
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        # 执行端队列已满时不阻塞接收循环，由调用方改走 XML 文件
+        self.sock.setblocking(False)
+
+    def send(self, command):
+        try:
+            self.sock.sendto(json.dumps(command).encode(), self.path)
+            return True
+        except OSError:
+            return False
+
+    def close(self):
+        self.sock.close()
+
+
+class CommandListener:
+    """执行端使用：绑定本地指令通道，逐条取出指令 dict"""
+    def __init__(self, path=COMMAND_SOCKET):
+        self.path = path
+        # 上次异常退出残留的 socket 文件
+        if os.path.exists(path):
+            os.unlink(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(path)
+        os.chmod(path, 0o600)
+
+    def receive(self, timeout=None):
+        """等待下一条指令，超时返回 None"""
+        self.sock.settimeout(timeout)
+        try:
+            data = self.sock.recv(MAX_COMMAND_SIZE)
+        except socket.timeout:
+            return None
+        return json.loads(data.decode())
+
+    def close(self):
+        self.sock.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
@@ -0,0 +1,130 @@
+import time
+import heapq
+import atexit
+import itertools
+import threading
+import concurrent.futures
+from command_dispatcher import get_dispatcher
+from command_common import copy_result
+
+
+class ScheduledSend:
+    """排队中的一次定时发送：到期后把 command 发给 ip，future 的结果为 DispatchOutcome"""
+    __slots__ = ("due", "seq", "ip", "command", "port", "cancelled", "future")
+
+    def __init__(self, due, seq, ip, command, port):
+        self.due = due
+        self.seq = seq
+        self.ip = ip
+        self.command = command
+        self.port = port
+        self.cancelled = False
+        self.future = concurrent.futures.Future()
+
+    def __lt__(self, other):
+        return (self.due, self.seq) < (other.due, other.seq)
+
+    @property
+    def remaining(self):
+        return max(0.0, self.due - time.monotonic())
+
+    def __repr__(self):
+        return f"<{self.command.name} -> {self.ip}，{self.remaining:.1f} 秒后发送>"
+
+
+class DispatchScheduler:
+    """
+    基于最小堆的后台定时发送队列：按到期时间把指令交给分发器，不阻塞调用方。
+    取消采用惰性删除：只做标记，到达堆顶时丢弃。
+    """
+    def __init__(self, dispatcher=None):
+        self.dispatcher = dispatcher or get_dispatcher()
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True, name="DispatchScheduler")
+        self._thread.start()
+
+    def schedule(self, command, ip, delay=0.0, port=None, future=None):
+        """delay 秒后把 command 发给 ip，返回 ScheduledSend"""
+        with self._cond:
+            entry = ScheduledSend(time.monotonic() + delay, next(self._seq), ip, command, port)
+            if future is not None:
+                entry.future = future
+            heapq.heappush(self._heap, entry)
+            self._cond.notify()
+        return entry
+
+    def stagger(self, command, targets, interval, port=None):
+        """按 targets 的顺序每隔 interval 秒发给一架无人机，第一架立即发送"""
+        return [self.schedule(command, ip, i * interval, port) for i, ip in enumerate(targets)]
+
+    def cancel(self, ips=None, name=None):
+        """取消发给 ips（None 表示全部）的、指令名为 name（None 表示任意）的待发送项，返回被取消的项"""
+        cancelled = self._remove(ips, name)
+        for entry in cancelled:
+            entry.future.cancel()
+        return cancelled
+
+    def reschedule(self, ip, delay, name=None):
+        """把发给 ip 的待发送项改为从现在起 delay 秒后依次发送（沿用原来的 future），返回新的项"""
+        return [self.schedule(entry.command, entry.ip, delay, entry.port, entry.future)
+                for entry in self._remove([ip], name)]
+
+    def _remove(self, ips, name):
+        ips = None if ips is None else set(ips)
+        cancelled = []
+        with self._cond:
+            for entry in self._heap:
+                if entry.cancelled or (ips is not None and entry.ip not in ips) \
+                        or (name is not None and entry.command.name != name):
+                    continue
+                entry.cancelled = True
+                cancelled.append(entry)
+        return sorted(cancelled)
+
+    def queue(self):
+        """按发送顺序返回尚未发送的项（只读快照）"""
+        with self._cond:
+            return sorted(entry for entry in self._heap if not entry.cancelled)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    while self._heap and self._heap[0].cancelled:
+                        heapq.heappop(self._heap)
+                    timeout = self._heap[0].due - time.monotonic() if self._heap else None
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                if self._closed:
+                    return
+                entry = heapq.heappop(self._heap)
+            futures = self.dispatcher.submit(entry.command, [entry.ip], entry.port)
+            futures[entry.ip].add_done_callback(lambda f, target=entry.future: copy_result(f, target))
+
+    def close(self):
+        """停止后台线程，未发送的项全部取消"""
+        with self._cond:
+            self._closed = True
+            for entry in self._heap:
+                entry.future.cancel()
+            self._heap.clear()
+            self._cond.notify()
+        self._thread.join(1.0)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler(create=True):
+    """进程内共用的定时发送队列；create 为 False 且尚未创建时返回 None"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None and create:
+            _scheduler = DispatchScheduler()
+            atexit.register(_scheduler.close)
+        return _scheduler
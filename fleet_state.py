@@ -0,0 +1,474 @@
+import os
+import time
+import socket
+import signal
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from telemetry import TelemetryState, SequenceTracker, receive_batch, parse_datagrams, RECV_BUFFER_SIZE
+
+# 共享内存中的机队状态表，每架无人机一行。
+# lock 为顺序锁计数：写入前加一（奇数表示正在写），写完再加一；
+# 读者复制数据前后 lock 相同且为偶数，说明读到的是一致的一行。
+# ip 为 0 表示空行。pos 为界面坐标（z 轴向上，已取反）。
+# packets 为累计收到的状态数，expected/received/duplicates/reordered/jitter 为序号统计。
+ROW_DTYPE = np.dtype([
+    ("lock", "<u4"),
+    ("ip", "<u4"),
+    ("drone_id", "<u2"),
+    ("flags", "<u2"),
+    ("seq", "<u4"),
+    ("timestamp", "<f8"),
+    ("recv_time", "<f8"),
+    ("pos", "<f4", (3,)),
+    ("quat", "<f4", (4,)),
+    ("battery", "<f4"),
+    ("packets", "<u4"),
+    ("expected", "<u4"),
+    ("received", "<u4"),
+    ("duplicates", "<u4"),
+    ("reordered", "<u4"),
+    ("jitter", "<f4"),
+])
+# 表头：标记、创建者进程号、行数。同名的表已存在时，只有创建者进程已退出才当作遗留的表回收
+HEADER_DTYPE = np.dtype([
+    ("magic", "<u4"),
+    ("owner_pid", "<u4"),
+    ("rows", "<u4"),
+    ("reserved", "<u4"),
+])
+TABLE_MAGIC = 0x54534655  # "UFST"
+# 默认容量：每个写入进程的分区行数
+ROWS_PER_PARTITION = 1024
+# 监视端创建的共享状态表的名字，其他工具按此名字连接
+FLEET_STATE_NAME = "uav_fleet_state"
+
+
+def ip_to_int(ip):
+    return int.from_bytes(socket.inet_aton(ip), "big")
+
+
+def int_to_ip(value):
+    return socket.inet_ntoa(int(value).to_bytes(4, "big"))
+
+
+def _record_to_state(record):
+    return TelemetryState(record["pos"].astype(float).reshape(1, 3),
+                          record["quat"].astype(float).reshape(1, 4),
+                          float(record["battery"]), int(record["drone_id"]),
+                          int(record["seq"]), float(record["timestamp"]))
+
+
+def _attach_shared_memory(name):
+    """连接已有的共享内存，不交给 resource_tracker 管理（否则本进程退出时会把它删除）"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python 3.13 之前没有 track 参数
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _reclaim_stale(name):
+    """同名共享内存已存在：确认其创建者已退出后删除，否则抛出 FileExistsError"""
+    shm = _attach_shared_memory(name)
+    try:
+        header = np.frombuffer(shm.buf, dtype=HEADER_DTYPE, count=1)[0].copy() \
+            if shm.size >= HEADER_DTYPE.itemsize else None
+    finally:
+        shm.close()
+    if header is None or header["magic"] != TABLE_MAGIC:
+        raise FileExistsError(f"共享内存 {name} 已存在且不是机队状态表，请换一个名字或手动删除 /dev/shm/{name}")
+    pid = int(header["owner_pid"])
+    if pid != os.getpid() and _pid_alive(pid):
+        raise FileExistsError(f"机队状态表 {name} 正被进程 {pid} 使用（可能已有监视端在运行），"
+                              f"请用 --fleet-state 指定其他名字")
+    print(f"回收上次异常退出遗留的机队状态表 {name}（创建者进程 {pid} 已退出）")
+    shm = _attach_shared_memory(name)
+    shm.unlink()
+    shm.close()
+
+
+class FleetStateTable:
+    """
+    基于 multiprocessing.shared_memory 的机队最新状态表。
+    行按写入进程划分为 partitions 个连续分区，每个分区只有一个写入者，
+    因此顺序锁不需要写者之间互斥；读者从不阻塞写者。
+    create=False 时按 name 连接已有的表（只读使用），见 attach。
+    同名的表正被其他进程使用时创建失败，抛出 FileExistsError。
+    max_age > 0 时写入者通过 expire 回收超过 max_age 秒未更新的行，供新的无人机使用。
+    """
+    def __init__(self, partitions=1, rows_per_partition=ROWS_PER_PARTITION, name=None, create=True, max_age=0.0):
+        self.partitions = partitions
+        self.rows_per_partition = rows_per_partition
+        self.owner = create
+        self.max_age = max_age
+        if create:
+            rows = partitions * rows_per_partition
+            size = HEADER_DTYPE.itemsize + rows * ROW_DTYPE.itemsize
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            except FileExistsError:
+                _reclaim_stale(name)
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            self.shm = _attach_shared_memory(name)
+        self.header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self.shm.buf)
+        if create:
+            self.header["magic"] = TABLE_MAGIC
+            self.header["owner_pid"] = os.getpid()
+            self.header["rows"] = rows
+        elif self.header["magic"] != TABLE_MAGIC:
+            self.header = None
+            self.shm.close()
+            raise ValueError(f"共享内存 {name} 不是机队状态表")
+        rows = int(self.header["rows"])
+        self.rows = np.ndarray((rows,), dtype=ROW_DTYPE, buffer=self.shm.buf, offset=HEADER_DTYPE.itemsize)
+        if create:
+            self.rows[:] = 0
+        self._reader_rows = {}  # 读者：ip -> 行号
+        self._row_of = {}    # 写入进程内：ip -> 行号
+        self._next_free = {}  # 写入进程内：分区 -> 下一个从未使用过的行
+        self._free = {}       # 写入进程内：分区 -> 已回收、可重新分配的行
+        self._next_expire = {}  # 写入进程内：分区 -> 下次检查过期行的时间
+        self.rejected = 0
+        self._last_lock = np.zeros(rows, dtype=np.uint32)     # 读者：上次读到的 lock
+        self._last_packets = np.zeros(rows, dtype=np.uint32)  # 读者：上次读到的累计包数
+
+    @classmethod
+    def attach(cls, name=FLEET_STATE_NAME):
+        """连接监视端创建的状态表，表不存在时抛出 FileNotFoundError"""
+        return cls(name=name, create=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def publish(self, partition, ip, state, stats=None, recv_time=0.0):
+        """写入一架无人机的最新状态（只能由该分区的写入进程调用）"""
+        row = self._row_of.get(ip)
+        if row is None:
+            free = self._free.get(partition)
+            if free:
+                row = free.pop()
+            else:
+                start = partition * self.rows_per_partition
+                row = self._next_free.get(partition, start)
+                if row >= start + self.rows_per_partition:
+                    self.rejected += 1
+                    return
+                self._next_free[partition] = row + 1
+            self._row_of[ip] = row
+        record = self.rows[row:row + 1]
+        lock = int(record["lock"][0])
+        record["lock"] = lock + 1
+        record["ip"] = ip_to_int(ip)
+        record["drone_id"] = state.drone_id
+        record["seq"] = max(state.seq, 0)
+        record["timestamp"] = state.timestamp
+        record["recv_time"] = recv_time
+        record["pos"] = state.pos[0]
+        record["quat"] = state.quat[0]
+        record["battery"] = state.battery
+        record["packets"] += 1
+        if stats is not None:
+            record["expected"] = stats.expected
+            record["received"] = stats.received
+            record["duplicates"] = stats.duplicates
+            record["reordered"] = stats.reordered
+            record["jitter"] = stats.jitter
+        record["lock"] = lock + 2
+
+    def remove(self, ip):
+        """清空一架无人机的行并归还给所在分区（只能由该分区的写入进程调用），没有该无人机时返回 False"""
+        row = self._row_of.pop(ip, None)
+        if row is None:
+            return False
+        record = self.rows[row:row + 1]
+        lock = int(record["lock"][0])
+        record["lock"] = lock + 1
+        for field in ROW_DTYPE.names[1:]:
+            record[field] = 0
+        record["lock"] = lock + 2
+        self._free.setdefault(row // self.rows_per_partition, []).append(row)
+        return True
+
+    def expire(self, partition, now=None):
+        """
+        回收本分区中超过 max_age 秒未更新的行（只能由该分区的写入进程调用），每秒最多检查一次。
+        返回被回收的 ip 列表
+        """
+        if self.max_age <= 0:
+            return []
+        now = time.time() if now is None else now
+        if now < self._next_expire.get(partition, 0.0):
+            return []
+        self._next_expire[partition] = now + 1.0
+        start = partition * self.rows_per_partition
+        stale = [ip for ip, row in self._row_of.items()
+                 if start <= row < start + self.rows_per_partition
+                 and self.rows[row]["recv_time"] < now - self.max_age]
+        for ip in stale:
+            self.remove(ip)
+        return stale
+
+    def poll(self, retries=3):
+        """
+        读者调用：返回上次调用以来有更新的行 [(ip, TelemetryState, packets)]。
+        正在写入的行本次跳过，下次再读，读者不会等待写者。
+        """
+        results = []
+        for _ in range(retries):
+            locks = self.rows["lock"].copy()
+            changed = np.flatnonzero((locks != self._last_lock) & (locks % 2 == 0))
+            if len(changed) == 0:
+                break
+            records = self.rows[changed]
+            # 复制之后 lock 未变，说明这一行读到的是一致的
+            stable = self.rows["lock"][changed] == locks[changed]
+            for row, record in zip(changed[stable], records[stable]):
+                self._last_lock[row] = locks[row]
+                if record["ip"] == 0:
+                    # 行已被回收
+                    self._last_packets[row] = 0
+                    continue
+                state = _record_to_state(record)
+                packets = int(record["packets"]) - int(self._last_packets[row])
+                self._last_packets[row] = record["packets"]
+                results.append((int_to_ip(record["ip"]), state, max(packets, 1)))
+            if stable.all():
+                break
+        return results
+
+    def read_record(self, ip, retries=100):
+        """按 ip 一致地读取一行（结构化数组的一个元素的副本），没有该无人机时返回 None"""
+        key = ip_to_int(ip)
+        row = self._reader_rows.get(ip)
+        if row is None or self.rows[row]["ip"] != key:
+            match = np.flatnonzero(self.rows["ip"] == key)
+            if len(match) == 0:
+                return None
+            row = self._reader_rows[ip] = int(match[0])
+        return self._read_row(row, retries)
+
+    def _read_row(self, row, retries=100):
+        """顺序锁读取：复制前后 lock 相同且为偶数才算读到一致的一行"""
+        for _ in range(retries):
+            lock = int(self.rows[row]["lock"])
+            if lock % 2 == 0:
+                record = self.rows[row].copy()
+                if int(self.rows[row]["lock"]) == lock:
+                    return record
+        raise TimeoutError(f"读取第 {row} 行状态时写入过于频繁")
+
+    def read(self, ip):
+        """返回某架无人机的最新 TelemetryState，没有时返回 None"""
+        record = self.read_record(ip)
+        return None if record is None else _record_to_state(record)
+
+    def snapshot(self):
+        """所有无人机的快照（结构化数组副本，每一行各自一致，不会读到写了一半的行）"""
+        records = self.rows.copy()
+        locks = records["lock"]
+        # 整表复制期间被改写的行单独重读
+        torn = (locks % 2 == 1) | (self.rows["lock"] != locks)
+        for row in np.flatnonzero(torn):
+            records[row] = self._read_row(row)
+        return records[records["ip"] != 0]
+
+    def states(self):
+        """{ip: TelemetryState}"""
+        return {int_to_ip(record["ip"]): _record_to_state(record) for record in self.snapshot()}
+
+    def close(self):
+        self.rows = None
+        self.header = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+class _RowStats:
+    """由共享表中的一行构造，接口与 SequenceStats 的只读部分一致"""
+    __slots__ = ("expected", "received", "duplicates", "reordered", "jitter")
+
+    def __init__(self, record):
+        self.expected = int(record["expected"])
+        self.received = int(record["received"])
+        self.duplicates = int(record["duplicates"])
+        self.reordered = int(record["reordered"])
+        self.jitter = float(record["jitter"])
+
+    @property
+    def lost(self):
+        return max(self.expected - self.received, 0)
+
+    @property
+    def loss_rate(self):
+        return self.lost / self.expected if self.expected else 0.0
+
+    def as_dict(self):
+        return {"expected": self.expected, "received": self.received, "lost": self.lost,
+                "loss_rate": round(self.loss_rate, 6), "duplicates": self.duplicates,
+                "reordered": self.reordered, "jitter_ms": round(self.jitter * 1000, 3)}
+
+
+class SharedSequenceStats:
+    """
+    多进程接收时的序号统计：各写入进程各自用 SequenceTracker 过滤，
+    统计结果随状态写入共享表，界面进程通过本类以 SequenceTracker 相同的接口读取。
+    """
+    def __init__(self, table):
+        self.table = table
+        self._forgotten = set()
+        self._row_of = {}  # ip -> 行号，找不到时再扫描整表
+
+    def _records(self):
+        rows = self.table.rows
+        return rows[rows["ip"] != 0]
+
+    def stats(self, ip):
+        key = ip_to_int(ip)
+        row = self._row_of.get(ip)
+        if row is None or self.table.rows[row]["ip"] != key:
+            match = np.flatnonzero(self.table.rows["ip"] == key)
+            if len(match) == 0:
+                return None
+            row = self._row_of[ip] = int(match[0])
+        record = self.table.rows[row]
+        if record["expected"] == 0:
+            return None
+        return _RowStats(record)
+
+    def forget(self, ip):
+        # 统计由写入进程持有，界面进程无法清除，只在汇总中忽略
+        self._forgotten.add(ip)
+
+    def snapshot(self):
+        result = {}
+        for record in self._records():
+            ip = int_to_ip(record["ip"])
+            if ip not in self._forgotten and record["expected"] > 0:
+                result[ip] = _RowStats(record).as_dict()
+        return result
+
+    def totals(self):
+        entries = list(self.snapshot().values())
+        expected = sum(s["expected"] for s in entries)
+        received = sum(s["received"] for s in entries)
+        return {"drones": len(entries), "expected": expected, "received": received,
+                "lost": sum(s["lost"] for s in entries),
+                "loss_rate": round(1 - received / expected, 6) if expected else None,
+                "duplicates": sum(s["duplicates"] for s in entries),
+                "reordered": sum(s["reordered"] for s in entries)}
+
+
+def ingest_worker(table, partition, port, listen_ip, stop_event, poll_timeout=0.2):
+    """
+    接收进程：与其他进程以 SO_REUSEPORT 共用端口，内核按来源地址把同一架无人机
+    固定分给同一个进程。解析、按 seq 过滤后写入共享表中本进程的分区。
+    """
+    # Ctrl+C 由界面进程处理，再通过 stop_event 通知各接收进程
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER_SIZE)
+    sock.bind((listen_ip, port))
+    sock.settimeout(poll_timeout)
+    tracker = SequenceTracker()
+    try:
+        while not stop_event.is_set():
+            try:
+                datagrams = receive_batch(sock)
+            except socket.timeout:
+                for ip in table.expire(partition):
+                    tracker.forget(ip)
+                continue
+            recv_time = time.time()
+            try:
+                states = parse_datagrams(datagrams)
+            except Exception as e:
+                print(f"[接收进程 {partition}] 解析异常: {e}")
+                continue
+            for ip, state in states:
+                if tracker.accept(ip, state, recv_time):
+                    table.publish(partition, ip, state, tracker.stats(ip), recv_time)
+            for ip in table.expire(partition, recv_time):
+                tracker.forget(ip)
+    finally:
+        sock.close()
+
+
+def start_workers(table, port, listen_ip="0.0.0.0"):
+    """
+    按表的分区数启动接收进程（fork 方式，子进程直接继承共享内存映射），
+    返回 (processes, stop_event)
+    """
+    context = multiprocessing.get_context("fork")
+    stop_event = context.Event()
+    processes = []
+    for partition in range(table.partitions):
+        process = context.Process(target=ingest_worker, name=f"ingest-{partition}",
+                                  args=(table, partition, port, listen_ip, stop_event), daemon=True)
+        process.start()
+        processes.append(process)
+    return processes, stop_event
+
+
+def stop_workers(processes, stop_event, timeout=1.0):
+    stop_event.set()
+    for process in processes:
+        process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+
+
+def default_worker_count():
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+# 控制台辅助函数：按需连接监视端的状态表
+_shared_table = None
+
+
+def _connect(name=FLEET_STATE_NAME):
+    """连接状态表；之前连接的表的创建者已退出（监视端重启）时重新连接新的表"""
+    global _shared_table
+    if _shared_table is not None and not _pid_alive(int(_shared_table.header["owner_pid"])):
+        _shared_table.close()
+        _shared_table = None
+    if _shared_table is None:
+        _shared_table = FleetStateTable.attach(name)
+    return _shared_table
+
+
+def where(ip):
+    """返回某架无人机的最新位置（界面坐标，z 轴向上），没有时返回 None"""
+    state = _connect().read(ip)
+    return None if state is None else state.pos[0]
+
+
+def show_fleet():
+    """打印机队中所有无人机的最新状态"""
+    records = _connect().snapshot()
+    now = time.time()
+    print(f"{'IP':<16}{'x':>9}{'y':>9}{'z':>9}{'电量':>7}{'seq':>10}{'距今(s)':>9}")
+    for record in records:
+        x, y, z = record["pos"]
+        age = now - record["recv_time"] if record["recv_time"] > 0 else float("nan")
+        print(f"{int_to_ip(record['ip']):<16}{x:>9.2f}{y:>9.2f}{z:>9.2f}{record['battery']:>7.0f}"
+              f"{record['seq']:>10}{age:>9.1f}")
+    print(f"共 {len(records)} 架无人机")
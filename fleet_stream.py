@@ -0,0 +1,397 @@
+import time
+import socket
+import struct
+import selectors
+import threading
+import argparse
+from collections import deque
+import numpy as np
+from fleet_state import FLEET_STATE_NAME, FleetStateTable, ip_to_int, int_to_ip
+from telemetry import TelemetryState
+
+# 机队状态转发：监视端把共享状态表按固定频率推送给任意多个 TCP 订阅者。
+# 每帧 = 帧头 + n_full 个完整条目 + n_delta 个增量条目（小端、紧凑排列）：
+#   帧头   magic "UAVF" | version u8 | kind u8（0 关键帧，1 增量帧）| reserved u16 |
+#          n_full u32 | n_delta u32 | time f64
+#   完整条目 ip u32 | seq u32 | pos 3*f32 | quat 4*f32 | battery f32
+#   增量条目 ip u32 | seq u32 | dpos 3*i16（厘米，相对上一次发送的值）| quat 4*i16（乘 32767）| battery u8
+# 关键帧包含全部无人机，客户端收到后重置本地状态；增量帧只包含变化的无人机，
+# 新出现或位移超出 i16 范围的无人机以完整条目发送。
+STREAM_MAGIC = b"UAVF"
+STREAM_VERSION = 1
+KIND_KEYFRAME = 0
+KIND_DELTA = 1
+HEADER = struct.Struct("<4sBBHIId")
+FULL_DTYPE = np.dtype([
+    ("ip", "<u4"),
+    ("seq", "<u4"),
+    ("pos", "<f4", (3,)),
+    ("quat", "<f4", (4,)),
+    ("battery", "<f4"),
+])
+DELTA_DTYPE = np.dtype([
+    ("ip", "<u4"),
+    ("seq", "<u4"),
+    ("dpos", "<i2", (3,)),
+    ("quat", "<i2", (4,)),
+    ("battery", "u1"),
+])
+POS_STEP = 0.01      # 增量位置的量化步长（米）
+QUAT_SCALE = 32767
+DEFAULT_STREAM_PORT = 10101
+# 订阅者发送缓冲超过该字节数说明跟不上，丢弃积压并改发关键帧
+MAX_BACKLOG = 1 << 20
+
+
+def encode_frame(kind, full, delta, timestamp=None):
+    header = HEADER.pack(STREAM_MAGIC, STREAM_VERSION, kind, 0, len(full), len(delta),
+                         time.time() if timestamp is None else timestamp)
+    return header + full.tobytes() + delta.tobytes()
+
+
+class _Subscriber:
+    __slots__ = ("sock", "addr", "out", "frames", "head_sent", "needs_keyframe")
+
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.out = bytearray()
+        self.frames = deque()  # out 中各帧的长度，第一帧可能已发送了 head_sent 字节
+        self.head_sent = 0
+        self.needs_keyframe = True
+
+    def queue(self, frame):
+        self.out += frame
+        self.frames.append(len(frame))
+
+    def consumed(self, sent):
+        """已发送 sent 字节：从 out 中移除并推进帧边界"""
+        del self.out[:sent]
+        self.head_sent += sent
+        while self.frames and self.head_sent >= self.frames[0]:
+            self.head_sent -= self.frames.popleft()
+
+    def drop_backlog(self):
+        """丢弃尚未开始发送的整帧；已发送一部分的帧保留剩余部分，保证客户端的帧边界不乱"""
+        if not self.frames:
+            return
+        if self.head_sent:
+            del self.out[self.frames[0] - self.head_sent:]
+            while len(self.frames) > 1:
+                self.frames.pop()
+        else:
+            self.out.clear()
+            self.frames.clear()
+
+
+class FleetStreamServer(threading.Thread):
+    """
+    读取共享内存状态表，按 rate 频率向所有订阅者推送增量帧，
+    每 keyframe_interval 秒以及新订阅者连接时发送关键帧。
+    增量以服务端记录的“客户端已知值”为基准计算，量化误差不会累积。
+    """
+    def __init__(self, fleet_state, host="127.0.0.1", port=DEFAULT_STREAM_PORT, rate=10.0, keyframe_interval=5.0):
+        super().__init__(daemon=True, name="FleetStreamServer")
+        self.fleet_state = fleet_state
+        self.period = 1.0 / max(float(rate), 0.1)
+        self.keyframe_interval = keyframe_interval
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen()
+        self.listener.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        self.subscribers = {}
+        self._stop_event = threading.Event()
+
+        # 客户端已知的状态（按服务端槽位存放）
+        self._slot_of = {}  # ip(u32) -> 槽位
+        self._free_slots = []  # 已移除的无人机空出的槽位
+        self._known = np.zeros(0, dtype=FULL_DTYPE)
+        self._recv_time = np.zeros(0)
+        self.frames = 0
+        self.bytes_sent = 0
+
+    @property
+    def address(self):
+        return self.listener.getsockname()
+
+    def run(self):
+        next_tick = time.monotonic()
+        last_keyframe = 0.0
+        while not self._stop_event.is_set():
+            timeout = max(next_tick - time.monotonic(), 0)
+            for key, events in self.selector.select(timeout):
+                if key.fileobj is self.listener:
+                    self._accept()
+                else:
+                    self._service(key.data, events)
+            now = time.monotonic()
+            if now < next_tick:
+                continue
+            next_tick += self.period
+            if now > next_tick:
+                next_tick = now + self.period
+            try:
+                full, delta = self._diff()
+            except Exception as e:
+                print(f"读取机队状态异常: {e}")
+                continue
+            keyframe_due = now - last_keyframe >= self.keyframe_interval
+            if keyframe_due:
+                last_keyframe = now
+            self._broadcast(full, delta, keyframe_due)
+        for subscriber in list(self.subscribers.values()):
+            self._drop(subscriber)
+        self.selector.close()
+        self.listener.close()
+
+    def _accept(self):
+        try:
+            sock, addr = self.listener.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        subscriber = _Subscriber(sock, addr)
+        self.subscribers[sock] = subscriber
+        self.selector.register(sock, selectors.EVENT_READ, subscriber)
+        print(f"订阅者 {addr} 已连接")
+
+    def _service(self, subscriber, events):
+        if events & selectors.EVENT_READ:
+            # 订阅者不发送数据，可读只意味着断开
+            try:
+                if not subscriber.sock.recv(4096):
+                    self._drop(subscriber)
+                    return
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError:
+                self._drop(subscriber)
+                return
+        if events & selectors.EVENT_WRITE:
+            self._flush(subscriber)
+
+    def _flush(self, subscriber):
+        try:
+            sent = subscriber.sock.send(subscriber.out)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self._drop(subscriber)
+            return
+        subscriber.consumed(sent)
+        self.bytes_sent += sent
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if subscriber.out else 0)
+        self.selector.modify(subscriber.sock, events, subscriber)
+
+    def _drop(self, subscriber):
+        self.subscribers.pop(subscriber.sock, None)
+        try:
+            self.selector.unregister(subscriber.sock)
+        except (KeyError, ValueError):
+            pass
+        subscriber.sock.close()
+        print(f"订阅者 {subscriber.addr} 已断开")
+
+    def _diff(self):
+        """对比状态表与客户端已知状态，返回本周期的 (完整条目, 增量条目)，并更新已知状态"""
+        records = self.fleet_state.snapshot()
+        # 已从状态表移除的无人机不再出现在之后的关键帧中，客户端收到关键帧后随之移除
+        for ip in self._slot_of.keys() - set(records["ip"].tolist()):
+            slot = self._slot_of.pop(ip)
+            self._known[slot] = 0
+            self._recv_time[slot] = -1.0
+            self._free_slots.append(slot)
+        if len(records) == 0:
+            return np.zeros(0, dtype=FULL_DTYPE), np.zeros(0, dtype=DELTA_DTYPE)
+        new_ips = [int(ip) for ip in records["ip"] if int(ip) not in self._slot_of]
+        while new_ips and self._free_slots:
+            self._slot_of[new_ips.pop()] = self._free_slots.pop()
+        if new_ips:
+            start = len(self._known)
+            for i, ip in enumerate(new_ips):
+                self._slot_of[ip] = start + i
+            self._known = np.concatenate((self._known, np.zeros(len(new_ips), dtype=FULL_DTYPE)))
+            self._recv_time = np.concatenate((self._recv_time, np.full(len(new_ips), -1.0)))
+        slots = np.fromiter((self._slot_of[int(ip)] for ip in records["ip"]), dtype=np.intp, count=len(records))
+
+        changed = records["recv_time"] != self._recv_time[slots]
+        records, slots = records[changed], slots[changed]
+        self._recv_time[slots] = records["recv_time"]
+
+        steps = np.round((records["pos"] - self._known["pos"][slots]) / POS_STEP)
+        fresh = np.isin(self._known["ip"][slots], 0)
+        as_full = fresh | (np.abs(steps) > 32767).any(axis=1)
+
+        full = np.zeros(int(as_full.sum()), dtype=FULL_DTYPE)
+        for name in ("ip", "seq", "pos", "quat", "battery"):
+            full[name] = records[name][as_full]
+        self._known[slots[as_full]] = full
+
+        keep = ~as_full
+        delta = np.zeros(int(keep.sum()), dtype=DELTA_DTYPE)
+        delta["ip"] = records["ip"][keep]
+        delta["seq"] = records["seq"][keep]
+        delta["dpos"] = steps[keep]
+        delta["quat"] = np.round(np.clip(records["quat"][keep], -1, 1) * QUAT_SCALE)
+        delta["battery"] = np.clip(np.round(records["battery"][keep]), 0, 255)
+        # 已知状态按客户端解码后的值更新，保证两端一致
+        known = self._known[slots[keep]]
+        known["seq"] = delta["seq"]
+        known["pos"] += delta["dpos"] * POS_STEP
+        known["quat"] = delta["quat"] / QUAT_SCALE
+        known["battery"] = delta["battery"]
+        self._known[slots[keep]] = known
+        return full, delta
+
+    def _broadcast(self, full, delta, keyframe_due):
+        if not self.subscribers:
+            return
+        delta_frame = encode_frame(KIND_DELTA, full, delta) if len(full) or len(delta) else None
+        keyframe = None
+        for subscriber in list(self.subscribers.values()):
+            if len(subscriber.out) > MAX_BACKLOG:
+                # 跟不上的订阅者：丢弃积压的整帧，下一帧改发关键帧
+                subscriber.drop_backlog()
+                subscriber.needs_keyframe = True
+            if keyframe_due or subscriber.needs_keyframe:
+                if keyframe is None:
+                    keyframe = encode_frame(KIND_KEYFRAME, self._known[self._known["ip"] != 0],
+                                            np.zeros(0, dtype=DELTA_DTYPE))
+                subscriber.queue(keyframe)
+                subscriber.needs_keyframe = False
+            elif delta_frame is not None:
+                subscriber.queue(delta_frame)
+            else:
+                continue
+            self.frames += 1
+            self._flush(subscriber)
+
+    def stop(self, timeout=1.0):
+        self._stop_event.set()
+        self.join(timeout)
+
+
+class FleetStreamClient:
+    """订阅监视端的机队状态流，维护本地的最新状态 {ip: TelemetryState}"""
+    def __init__(self, host="127.0.0.1", port=DEFAULT_STREAM_PORT, timeout=None):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.known = {}  # ip(u32) -> FULL_DTYPE 条目
+        self.frames = 0
+        self.bytes_received = 0
+
+    def _recv_exact(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("监视端已关闭连接")
+            data += chunk
+        self.bytes_received += size
+        return bytes(data)
+
+    def read_frame(self):
+        """读取并应用一帧，返回本帧变化的 ip 列表"""
+        magic, version, kind, _, n_full, n_delta, _ = HEADER.unpack(self._recv_exact(HEADER.size))
+        if magic != STREAM_MAGIC or version != STREAM_VERSION:
+            raise ValueError(f"无法识别的数据流版本: {magic!r} v{version}")
+        body = self._recv_exact(n_full * FULL_DTYPE.itemsize + n_delta * DELTA_DTYPE.itemsize)
+        split = n_full * FULL_DTYPE.itemsize
+        full = np.frombuffer(body[:split], dtype=FULL_DTYPE)
+        delta = np.frombuffer(body[split:], dtype=DELTA_DTYPE)
+        if kind == KIND_KEYFRAME:
+            self.known = {}
+        for entry in full:
+            self.known[int(entry["ip"])] = entry.copy()
+        for entry in delta:
+            known = self.known.get(int(entry["ip"]))
+            if known is None:
+                continue  # 尚未收到关键帧
+            known["seq"] = entry["seq"]
+            known["pos"] += entry["dpos"] * POS_STEP
+            known["quat"] = entry["quat"] / QUAT_SCALE
+            known["battery"] = entry["battery"]
+        self.frames += 1
+        return [int_to_ip(ip) for ip in np.concatenate((full["ip"], delta["ip"]))]
+
+    def state(self, ip):
+        entry = self.known.get(ip_to_int(ip))
+        if entry is None:
+            return None
+        return TelemetryState(entry["pos"].astype(float).reshape(1, 3), entry["quat"].astype(float).reshape(1, 4),
+                              float(entry["battery"]), 0, int(entry["seq"]), float("nan"))
+
+    def close(self):
+        self.sock.close()
+
+
+class StreamReceiver(threading.Thread):
+    """次级监视端使用：订阅状态流，把变化的状态写入 LatestStateTable"""
+    def __init__(self, client, table):
+        super().__init__(daemon=True, name="StreamReceiver")
+        self.client = client
+        self.table = table
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                changed = self.client.read_frame()
+            except (OSError, ConnectionError, ValueError) as e:
+                if not self._stop_event.is_set():
+                    print(f"状态流接收异常: {e}")
+                break
+            for ip in changed:
+                state = self.client.state(ip)
+                if state is not None:
+                    self.table.put(ip, state)
+
+    def stop(self, timeout=1.0):
+        self._stop_event.set()
+        self.client.close()
+        self.join(timeout)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="机队状态流：serve 从共享状态表转发，watch 订阅并每秒打印统计")
+    parser.add_argument("mode", choices=["serve", "watch"], help="serve 独立转发（监视端已在运行时），watch 订阅")
+    parser.add_argument("--host", default="127.0.0.1", help="监听或连接的地址，默认127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_STREAM_PORT, help=f"TCP端口，默认{DEFAULT_STREAM_PORT}")
+    parser.add_argument("--rate", type=float, default=10, help="推送频率（Hz），默认10")
+    parser.add_argument("--keyframe-interval", type=float, default=5.0, help="关键帧间隔（秒），默认5")
+    parser.add_argument("--fleet-state", default=FLEET_STATE_NAME, help=f"共享状态表名字，默认 {FLEET_STATE_NAME}")
+    args = parser.parse_args()
+
+    if args.mode == "serve":
+        server = FleetStreamServer(FleetStateTable.attach(args.fleet_state), args.host, args.port,
+                                   args.rate, args.keyframe_interval)
+        server.start()
+        print(f"机队状态流服务于 {args.host}:{args.port}（Ctrl+C 可退出）")
+        try:
+            while server.is_alive():
+                server.join(1.0)
+        except KeyboardInterrupt:
+            server.stop()
+    else:
+        client = FleetStreamClient(args.host, args.port)
+        last_report = time.monotonic()
+        last_bytes = 0
+        try:
+            while True:
+                client.read_frame()
+                now = time.monotonic()
+                if now - last_report >= 1.0:
+                    rate = (client.bytes_received - last_bytes) / (now - last_report)
+                    print(f"{len(client.known)} 架无人机，已收 {client.frames} 帧，{rate / 1024:.1f} KB/s")
+                    last_report, last_bytes = now, client.bytes_received
+        except KeyboardInterrupt:
+            print("\n订阅已退出")
+        except OSError as e:
+            # 监视端退出或转发中断（ConnectionError 也是 OSError）
+            print(f"状态流已关闭：{e}")
+        finally:
+            client.close()
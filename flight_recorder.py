@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import numpy as np
+
+# 每一列单独存放为一个内存映射文件：列名 -> (dtype, 每行元素个数)
+COLUMNS = {
+    "recv_time": ("<f8", 1),
+    "ip": ("<u2", 1),
+    "pos": ("<f4", 3),
+    "quat": ("<f4", 4),
+    "battery": ("<f4", 1),
+}
+INDEX_FILE = "index.json"
+LOG_VERSION = 1
+
+
+def _column_path(path, name):
+    return os.path.join(path, f"{name}.bin")
+
+
+def _open_column(path, name, rows, mode):
+    dtype, width = COLUMNS[name]
+    shape = (rows,) if width == 1 else (rows, width)
+    return np.memmap(_column_path(path, name), dtype=dtype, mode=mode, shape=shape)
+
+
+class FlightRecorder:
+    """
+    飞行记录器：把每条解析后的状态按列追加到内存映射文件中。
+    path 是一个目录，其中每列一个 .bin 文件，index.json 记录行数与 ip 表。
+    文件按容量倍增预分配，追加一条状态只是几次内存写入。
+    """
+    def __init__(self, path, capacity=65536, flush_interval=1.0):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.count = 0
+        self.capacity = 0
+        self.ips = []
+        self.ip_index = {}
+        self.flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+        self._columns = {}
+        self._resize(max(int(capacity), 1))
+        self.flush()
+
+    def _resize(self, capacity):
+        for name, column in self._columns.items():
+            column.flush()
+        self._columns = {}
+        for name, (dtype, width) in COLUMNS.items():
+            size = capacity * np.dtype(dtype).itemsize * width
+            with open(_column_path(self.path, name), "ab") as f:
+                f.truncate(size)
+            self._columns[name] = _open_column(self.path, name, capacity, "r+")
+        self.capacity = capacity
+
+    def append(self, ip, state, recv_time=None):
+        """追加一条 TelemetryState，recv_time 默认为当前时间"""
+        if self.count == self.capacity:
+            self._resize(2 * self.capacity)
+        ip_id = self.ip_index.get(ip)
+        if ip_id is None:
+            ip_id = len(self.ips)
+            self.ip_index[ip] = ip_id
+            self.ips.append(ip)
+        row = self.count
+        columns = self._columns
+        columns["recv_time"][row] = time.time() if recv_time is None else recv_time
+        columns["ip"][row] = ip_id
+        columns["pos"][row] = state.pos[0]
+        columns["quat"][row] = state.quat[0]
+        columns["battery"][row] = state.battery
+        self.count += 1
+        if time.monotonic() - self._last_flush > self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """把数据刷到磁盘并更新索引；索引先写临时文件再原子替换"""
+        for column in self._columns.values():
+            column.flush()
+        index = {"version": LOG_VERSION, "count": self.count, "ips": self.ips}
+        tmp_path = os.path.join(self.path, INDEX_FILE + ".part")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, os.path.join(self.path, INDEX_FILE))
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self._columns = {}
+        # 截掉预分配但未使用的部分
+        for name, (dtype, width) in COLUMNS.items():
+            with open(_column_path(self.path, name), "r+b") as f:
+                f.truncate(self.count * np.dtype(dtype).itemsize * width)
+
+
+class FlightLog:
+    """只读打开一份飞行记录，各列为零拷贝的内存映射数组"""
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE), "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("version") != LOG_VERSION:
+            raise ValueError(f"不支持的记录版本: {index.get('version')}")
+        self.count = index["count"]
+        self.ips = index["ips"]
+        self.columns = {}
+        for name in COLUMNS:
+            if self.count == 0:
+                dtype, width = COLUMNS[name]
+                self.columns[name] = np.empty((0,) if width == 1 else (0, width), dtype=dtype)
+            else:
+                self.columns[name] = _open_column(path, name, self.count, "r")
+
+    def __len__(self):
+        return self.count
+
+    def __getattr__(self, name):
+        if name in COLUMNS:
+            return self.columns[name]
+        raise AttributeError(name)
+
+    def time_range(self):
+        if self.count == 0:
+            return 0.0, 0.0
+        return float(self.columns["recv_time"][0]), float(self.columns["recv_time"][-1])
+
+    def row_at(self, t):
+        """接收时间不早于 t 的第一行（接收时间单调递增，二分查找）"""
+        return int(np.searchsorted(self.columns["recv_time"], t, side="left"))
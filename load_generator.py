@@ -0,0 +1,135 @@
+import socket
+import time
+import argparse
+import numpy as np
+from telemetry import encode_states
+
+# 模拟无人机使用的回环源地址：127.0.x.y，每架无人机一个，便于监视端按 ip 区分
+def drone_address(i):
+    return f"127.0.{i // 250 + 1}.{i % 250 + 1}"
+
+
+class FleetSimulator:
+    """
+    向量化模拟 N 架无人机的飞行轨迹
+    trajectory: circle 绕圈、figure8 八字、random 随机游走
+    坐标按机体发送习惯给出（z 轴向下）
+    """
+    def __init__(self, count, trajectory="circle", seed=0):
+        self.count = count
+        self.trajectory = trajectory
+        self.rng = np.random.default_rng(seed)
+        idx = np.arange(count)
+        side = int(np.ceil(np.sqrt(count)))
+        # 每架无人机一个网格中心，间隔 10 米
+        self.center = np.stack([(idx % side) * 10.0, (idx // side) * 10.0, np.zeros(count)], axis=1)
+        self.radius = 2.0 + self.rng.random(count) * 2.0
+        self.omega = 0.2 + self.rng.random(count) * 0.3
+        self.phase = self.rng.random(count) * 2 * np.pi
+        self.height = 2.0 + self.rng.random(count) * 3.0
+        self.pos = self.center + np.stack([self.radius, np.zeros(count), -self.height], axis=1)
+        self.velocity = np.zeros((count, 3))
+
+    def step(self, t, dt):
+        """返回时刻 t 的 (pos (N,3), quat (N,4), battery (N,))"""
+        prev = self.pos
+        a = self.omega * t + self.phase
+        if self.trajectory == "circle":
+            offset = np.stack([self.radius * np.cos(a), self.radius * np.sin(a), -self.height], axis=1)
+            pos = self.center + offset
+        elif self.trajectory == "figure8":
+            offset = np.stack([self.radius * np.sin(a), self.radius * np.sin(a) * np.cos(a),
+                               -self.height - 0.5 * np.sin(2 * a)], axis=1)
+            pos = self.center + offset
+        else:
+            self.velocity = 0.95 * self.velocity + self.rng.normal(0, 0.5, (self.count, 3)) * dt
+            pos = prev + self.velocity
+        self.pos = pos
+
+        # 机头朝向运动方向（只考虑偏航角）
+        d = pos - prev
+        yaw = np.arctan2(d[:, 1], d[:, 0])
+        quat = np.stack([np.cos(yaw / 2), np.zeros(self.count), np.zeros(self.count), np.sin(yaw / 2)], axis=1)
+        battery = np.clip(100.0 - t * 0.05, 0, 100) * np.ones(self.count)
+        return pos, quat, battery
+
+
+def format_text(pos, quat, battery):
+    """旧机型的文本格式：state x y z qw qx qy qz battery"""
+    return [("state " + " ".join(f"{v:.4f}" for v in (*p, *q, b))).encode()
+            for p, q, b in zip(pos, quat, battery)]
+
+
+def generate(count=10, rate=10.0, port=10001, host="127.0.0.1", duration=0, trajectory="circle", text=False):
+    # 每架无人机一个 socket，绑定到各自的回环地址
+    socks = []
+    try:
+        for i in range(count):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((drone_address(i), 0))
+            socks.append(sock)
+    except OSError as e:
+        print(f"创建第 {len(socks) + 1} 个 socket 失败（可能需要调大 ulimit -n）：{e}")
+        for sock in socks:
+            sock.close()
+        return
+
+    sim = FleetSimulator(count, trajectory)
+    ids = np.arange(count)
+    period = 1.0 / rate
+    print(f"模拟 {count} 架无人机，{rate} Hz，{'文本' if text else '二进制'}格式，发送到 {host}:{port}（Ctrl+C 可退出）")
+
+    start = time.monotonic()
+    next_tick = start
+    seq = 0
+    sent = errors = late = 0
+    last_report = start
+    try:
+        while duration <= 0 or time.monotonic() - start < duration:
+            now = time.monotonic()
+            if now < next_tick:
+                time.sleep(next_tick - now)
+            elif now - next_tick > period:
+                late += 1
+            t = next_tick - start
+            next_tick += period
+
+            pos, quat, battery = sim.step(t, period)
+            if text:
+                packets = format_text(pos, quat, battery)
+            else:
+                packets = encode_states(pos, quat, battery, ids, seq)
+            for sock, packet in zip(socks, packets):
+                try:
+                    sock.sendto(packet, (host, port))
+                    sent += 1
+                except OSError:
+                    errors += 1
+            seq += 1
+
+            now = time.monotonic()
+            if now - last_report >= 1.0:
+                print(f"已发送 {sent} 条，{sent / (now - start):.0f} 条/秒，发送失败 {errors} 条，落后周期 {late} 个")
+                last_report = now
+    except KeyboardInterrupt:
+        print("\n负载生成器已退出")
+    finally:
+        for sock in socks:
+            sock.close()
+    elapsed = time.monotonic() - start
+    print(f"共发送 {sent} 条，用时 {elapsed:.1f} 秒，平均 {sent / max(elapsed, 1e-9):.0f} 条/秒")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="模拟多架无人机向监视端发送状态消息")
+    parser.add_argument("--drones", type=int, default=10, help="模拟的无人机数量，默认10")
+    parser.add_argument("--rate", type=float, default=10, help="每架无人机的发送频率（Hz），默认10")
+    parser.add_argument("--port", type=int, default=10001, help="目标UDP端口，默认10001")
+    parser.add_argument("--host", default="127.0.0.1", help="目标地址，默认127.0.0.1")
+    parser.add_argument("--duration", type=float, default=0, help="运行时长（秒），0 表示一直运行")
+    parser.add_argument("--trajectory", choices=["circle", "figure8", "random"], default="circle", help="飞行轨迹，默认circle")
+    parser.add_argument("--text", action="store_true", help="使用旧的文本格式（不带 seq 和时间戳）")
+    args = parser.parse_args()
+
+    generate(args.drones, args.rate, args.port, args.host, args.duration, args.trajectory, args.text)
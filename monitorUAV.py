@@ -4,60 +4,390 @@ import sys
 import socket
 import numpy as np
 import select
+from collections import deque
 from PyQt6 import QtWidgets, QtCore
+import os
+import signal
+import time
+import json
 import argparse
+from flight_recorder import FlightRecorder, FlightLog
+from fleet_state import FLEET_STATE_NAME, FleetStateTable, SharedSequenceStats, start_workers, stop_workers, default_worker_count
+from fleet_stream import FleetStreamServer, FleetStreamClient, StreamReceiver, DEFAULT_STREAM_PORT
+from telemetry import parse_state, drain_socket, LatestStateTable, TelemetryReceiver, IngestProbe, SequenceTracker, RECV_BUFFER_SIZE
 
 LISTEN_IP = "0.0.0.0"
+# 回放时每个定时周期最多送入界面的记录条数，保证界面仍能响应
+MAX_REPLAY_PER_TICK = 2000
 
-def monitoring(port=10001):
-    print(f"监听UDP端口 {port} 中...（Ctrl+C 可退出）")
+def percentiles(samples, scale=1000.0):
+    """返回样本的 p50/p95/p99（默认换算为毫秒）"""
+    if len(samples) == 0:
+        return {"p50": None, "p95": None, "p99": None}
+    values = np.percentile(np.asarray(samples) * scale, [50, 95, 99])
+    return {"p50": round(float(values[0]), 3), "p95": round(float(values[1]), 3), "p99": round(float(values[2]), 3)}
 
-    try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.bind((LISTEN_IP, port))
-        sock.setblocking(False)  # 设置为非阻塞
-    except OSError as e:
-        print(f"端口 {port} 无法绑定（可能已被占用）：{e}")
+def dump_metrics(tracker, path):
+    """把序号统计写入 JSON 文件（先写临时文件再原子替换）"""
+    metrics = {"time": time.time(), "totals": tracker.totals(), "drones": tracker.snapshot()}
+    tmp_path = path + ".part"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(metrics, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def monitoring(port=10001, ingest="thread", trail_budget=5000, fps=30, record=None,
+               benchmark=0, benchmark_json=None, metrics=None, metrics_interval=5.0, retention=None,
+               workers=None, fleet_state_name=FLEET_STATE_NAME, serve_port=0, serve_rate=10.0,
+               stream=("127.0.0.1", DEFAULT_STREAM_PORT)):
+    """
+    serve_port 不为 0 时在本机该 TCP 端口转发机队状态（关键帧 + 增量），供其他监视端或记录程序订阅。
+    ingest 为 stream 时不接收 UDP，而是订阅另一监视端 stream=(host, port) 转发的状态（次级监视端）。
+    ingest 为 workers 时启动 workers 个接收进程（默认 CPU 核数减一）以 SO_REUSEPORT 共用端口，
+    解析结果写入共享内存状态表，界面进程只读取该表；此时飞行记录与延迟统计基于读到的合并后状态。
+    benchmark > 0 时（不支持 stream 模式）以离屏方式运行指定秒数，结束后汇报接收吞吐、丢包率、
+    延迟与每帧耗时分位数，benchmark_json 不为空时同时写入该文件。
+    fleet_state_name 不为空时，各模式都把每条状态发布到该名字的共享内存状态表，供其他工具读取。
+    metrics 不为空时每隔 metrics_interval 秒把各无人机的丢包、乱序与抖动统计写入该文件。
+    retention 为传给 UAVmonitor 的失联/移除时限与轨迹点数上限 {lost_after, evict_after, max_trail_points}
+    """
+    if ingest == "stream" and benchmark > 0:
+        # 状态流只按转发频率推送各无人机的最新状态，无法据此统计接收吞吐与丢包
+        print("基准测试需要直接接收 UDP，不能与 stream 模式同时使用")
+        sys.exit(1)
+    if ingest == "stream" and record:
+        # 状态流不含时间戳与 drone_id，且只是按转发频率采样的状态，飞行记录应在主监视端完成
+        print("飞行记录需要直接接收 UDP，不能与 stream 模式同时使用，请在主监视端使用 --record")
         sys.exit(1)
+    if ingest == "stream":
+        print(f"订阅 {stream[0]}:{stream[1]} 的机队状态流...（Ctrl+C 可退出）")
+    else:
+        print(f"监听UDP端口 {port} 中...（Ctrl+C 可退出）")
+    recorder = None
+    if record:
+        recorder = FlightRecorder(record)
+        print(f"飞行记录写入 {record}")
+    probe = None
+    if benchmark > 0:
+        # 必须在创建 QApplication 之前设置
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        probe = IngestProbe(recorder)
+        recorder = probe
+
+    sock = None
+    shared = None
+    # 共享状态表中超过移除时限未更新的行由写入者回收，与界面移除无人机的时限一致
+    evict_after = (retention or {}).get("evict_after", 0.0)
+    worker_processes = []
+    if ingest == "workers":
+        # 必须在创建 QApplication 之前 fork
+        try:
+            shared = FleetStateTable(partitions=workers or default_worker_count(), name=fleet_state_name or None,
+                                     max_age=evict_after)
+        except FileExistsError as e:
+            print(e)
+            sys.exit(1)
+        worker_processes, worker_stop = start_workers(shared, port, LISTEN_IP)
+        print(f"已启动 {len(worker_processes)} 个接收进程")
+    elif ingest == "stream":
+        # 次级监视端不发布共享状态表，避免与主监视端的同名表冲突
+        try:
+            stream_client = FleetStreamClient(*stream, timeout=5)
+            stream_client.sock.settimeout(None)
+        except OSError as e:
+            print(f"无法连接机队状态流 {stream[0]}:{stream[1]}：{e}")
+            sys.exit(1)
+    else:
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            if ingest != "single":
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER_SIZE)
+            sock.bind((LISTEN_IP, port))
+            if ingest != "thread":
+                sock.setblocking(False)  # 设置为非阻塞
+        except OSError as e:
+            print(f"端口 {port} 无法绑定（可能已被占用）：{e}")
+            sys.exit(1)
+        if fleet_state_name:
+            try:
+                shared = FleetStateTable(name=fleet_state_name, max_age=evict_after)
+            except FileExistsError as e:
+                print(e)
+                sock.close()
+                sys.exit(1)
+    if shared is not None and fleet_state_name:
+        print(f"机队状态发布到共享内存 {shared.name}")
+    server = None
+    if serve_port:
+        if shared is None:
+            print("转发机队状态需要共享状态表，请不要同时使用 --fleet-state \"\" 或 stream 模式")
+            sys.exit(1)
+        server = FleetStreamServer(shared, "127.0.0.1", serve_port, serve_rate)
+        server.start()
+        print(f"机队状态流服务于 127.0.0.1:{serve_port}，{serve_rate} Hz")
 
     app = QtWidgets.QApplication(sys.argv)
+    # 被 kill 时也正常退出事件循环，释放共享内存并关闭飞行记录
+    signal.signal(signal.SIGTERM, lambda *_: app.quit())
     computer_pos = [0, 0, 0]
-    window = UAVmonitor(computer_pos)
+    window = UAVmonitor(computer_pos, trail_budget, fps, **(retention or {}))
     window.show()
 
+    # 按 seq 丢弃重复与迟到的状态，并统计丢包、乱序与抖动
+    # （多进程接收时由各接收进程过滤，统计从共享表读取）
+    tracker = SequenceTracker() if ingest != "workers" else SharedSequenceStats(shared)
+    window.set_sequence_tracker(tracker)
+
+    # 状态送入界面时刻相对发送时间戳的延迟（端到端）
+    applied_latency = deque(maxlen=100000)
+
+    def apply_state(ip, state, packets=1):
+        if probe is not None and not np.isnan(state.timestamp):
+            applied_latency.append(time.time() - state.timestamp)
+        window.update_uav(ip, state.pos, state.battery, packets)
+
     def check_udp_data():
         # 使用 select 检查是否有可读数据
         readable, _, _ = select.select([sock], [], [], 0)
         if readable:
             try:
                 data, addr = sock.recvfrom(4096)
-                message = data.decode().split()
-                if message[0] == "state":
+                state = parse_state(data)
+                if state is not None and tracker.accept(addr[0], state):
                     print(f"收到状态消息，来自无人机 {addr}")
-                    pos = np.array([float(message[1]), float(message[2]), -float(message[3])]).reshape(1, 3)
-                    quat = np.array([float(message[4]), float(message[5]), float(message[6]), float(message[7])]).reshape(1, 4)
-                    battery = float(message[8])
-                    window.update_uav(addr[0], pos, battery)
+                    if recorder is not None:
+                        recorder.append(addr[0], state)
+                    if shared is not None:
+                        shared.publish(0, addr[0], state, tracker.stats(addr[0]), time.time())
+                    apply_state(addr[0], state)
                 # 可添加其他消息类型处理
             except Exception as e:
                 print(f"解析异常: {e}")
+        if shared is not None:
+            shared.expire(0)
+
+    # 批量模式统计：累计读取与合并丢弃的数量，每秒汇报一次
+    stats = {"drained": 0, "dropped": 0}
+
+    def check_udp_batch():
+        try:
+            latest, drained, dropped = drain_socket(sock, recorder=recorder, tracker=tracker, fleet_state=shared)
+        except OSError as e:
+            print(f"接收异常: {e}")
+            return
+        stats["drained"] += drained
+        stats["dropped"] += dropped
+        # 每架无人机每个周期只刷新一次
+        for ip, state in latest.items():
+            apply_state(ip, state)
+
+    def report_stats():
+        if stats["drained"] > 0:
+            print(f"过去1秒接收 {stats['drained']} 条数据报，合并丢弃 {stats['dropped']} 条旧状态")
+        stats["drained"] = 0
+        stats["dropped"] = 0
+
+    # 线程模式：接收线程写入最新状态表，界面按自己的节奏取走
+    table = LatestStateTable()
+    receiver = None
+
+    def consume_table():
+        states, packets = table.take_counted()
+        for ip, state in states.items():
+            apply_state(ip, state, packets.get(ip, 1))
+
+    def report_table():
+        received, overwritten, rejected = table.take_counters()
+        if received > 0:
+            print(f"过去1秒接收 {received} 条状态，合并丢弃 {overwritten} 条旧状态，超出容量拒绝 {rejected} 条")
+
+    # 多进程模式：读取共享状态表中有更新的行
+    shared_stats = {"packets": 0}
+
+    def consume_shared():
+        for ip, state, packets in shared.poll():
+            if recorder is not None:
+                recorder.append(ip, state)
+            apply_state(ip, state, packets)
+
+    def report_shared():
+        packets = int(shared.rows["packets"].sum(dtype=np.uint64))
+        received, shared_stats["packets"] = packets - shared_stats["packets"], packets
+        if received > 0:
+            print(f"过去1秒各接收进程共接收 {received} 条状态")
 
     # 每隔50毫秒检查一次是否有UDP数据
     timer = QtCore.QTimer()
-    timer.timeout.connect(check_udp_data)
+    report_timer = QtCore.QTimer()
+    if ingest == "thread":
+        receiver = TelemetryReceiver(sock, table, recorder=recorder, tracker=tracker, fleet_state=shared)
+        receiver.start()
+        timer.timeout.connect(consume_table)
+        report_timer.timeout.connect(report_table)
+        report_timer.start(1000)
+    elif ingest == "stream":
+        receiver = StreamReceiver(stream_client, table)
+        receiver.start()
+        timer.timeout.connect(consume_table)
+    elif ingest == "workers":
+        timer.timeout.connect(consume_shared)
+        report_timer.timeout.connect(report_shared)
+        report_timer.start(1000)
+    elif ingest == "batch":
+        timer.timeout.connect(check_udp_batch)
+        report_timer.timeout.connect(report_stats)
+        report_timer.start(1000)
+    else:
+        timer.timeout.connect(check_udp_data)
     timer.start(50)
 
+    def finish_benchmark():
+        elapsed = time.monotonic() - started
+        totals = tracker.totals()
+        if ingest != "workers":
+            expected, received = probe.loss()
+            drones, count = probe.drones, probe.received
+        else:
+            # 界面进程只看到合并后的状态，收包数取自接收进程的统计
+            expected, received = totals["expected"], totals["received"]
+            drones, count = totals["drones"], received
+        scheduler = window.scheduler
+        report = {
+            "duration_s": round(elapsed, 3),
+            "ingest": ingest,
+            "drones": drones,
+            "received": count,
+            "throughput_per_s": round(count / elapsed, 1),
+            "expected": expected,
+            "drop_rate": round(1 - received / expected, 6) if expected else None,
+            "sequence": totals,
+            "receive_latency_ms": percentiles(probe.latency),
+            "end_to_end_latency_ms": percentiles(applied_latency),
+            "frames": scheduler.frames,
+            "skipped_frames": scheduler.skipped,
+            "frame_time_ms": percentiles(scheduler.frame_times),
+        }
+        print("基准测试结果：")
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        if benchmark_json:
+            with open(benchmark_json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        app.quit()
+
+    metrics_timer = QtCore.QTimer()
+    if metrics:
+        metrics_timer.timeout.connect(lambda: dump_metrics(tracker, metrics))
+        metrics_timer.start(max(1, round(metrics_interval * 1000)))
+
+    started = time.monotonic()
+    if probe is not None:
+        QtCore.QTimer.singleShot(int(benchmark * 1000), QtCore.Qt.TimerType.PreciseTimer, finish_benchmark)
+
     try:
         sys.exit(app.exec())
     except KeyboardInterrupt:
         print("\n接收器已退出")
     finally:
-        sock.close()
+        if receiver is not None:
+            receiver.stop()
+        if server is not None:
+            server.stop()
+        if sock is not None:
+            sock.close()
+        if worker_processes:
+            stop_workers(worker_processes, worker_stop)
+        if metrics:
+            dump_metrics(tracker, metrics)
+        if record:
+            recorder = probe.recorder if probe is not None else recorder
+            recorder.close()
+            print(f"飞行记录已保存，共 {recorder.count} 条")
+        if shared is not None:
+            shared.close()
+            shared.unlink()
+
+def replaying(path, speed=1.0, trail_budget=5000, fps=30, retention=None):
+    """
+    回放飞行记录：按记录中的接收时间把状态送入监视界面
+    speed 为回放倍速，0 表示不等待，尽可能快地回放
+    """
+    log = FlightLog(path)
+    if len(log) == 0:
+        print(f"飞行记录 {path} 为空")
+        return
+    t0, t1 = log.time_range()
+    print(f"回放 {path}：{len(log)} 条记录，{len(log.ips)} 架无人机，时长 {t1 - t0:.1f} 秒")
+
+    app = QtWidgets.QApplication(sys.argv)
+    window = UAVmonitor([0, 0, 0], trail_budget, fps, **(retention or {}))
+    window.show()
+
+    ips = log.ips
+    ip_col, pos_col, battery_col = log.ip, log.pos, log.battery
+    progress = {"row": 0, "start": time.monotonic()}
+
+    def replay_tick():
+        row = progress["row"]
+        if speed > 0:
+            target = t0 + (time.monotonic() - progress["start"]) * speed
+            end = int(np.searchsorted(log.recv_time, target, side="right"))
+        else:
+            end = len(log)
+        end = min(end, row + MAX_REPLAY_PER_TICK)
+        for i in range(row, end):
+            window.update_uav(ips[ip_col[i]], np.asarray(pos_col[i:i + 1]), float(battery_col[i]))
+        progress["row"] = end
+        if end >= len(log):
+            timer.stop()
+            elapsed = time.monotonic() - progress["start"]
+            print(f"回放结束：{len(log)} 条记录，用时 {elapsed:.2f} 秒，{len(log) / max(elapsed, 1e-9):.0f} 条/秒")
+
+    timer = QtCore.QTimer()
+    timer.timeout.connect(replay_tick)
+    timer.start(0 if speed <= 0 else 10)
+
+    try:
+        sys.exit(app.exec())
+    except KeyboardInterrupt:
+        print("\n回放已退出")
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="程序运行指令")
     parser.add_argument("--port", type=int, default=10001, help="监听UDP端口，默认10001")
+    parser.add_argument("--ingest", choices=["thread", "batch", "single", "workers", "stream"], default="thread",
+                        help="接收模式：thread 独立线程接收（默认），batch 界面定时器中读空缓冲区并按无人机合并，"
+                             "single 每周期只读一条，workers 多个接收进程共用端口并写入共享内存，"
+                             "stream 订阅另一监视端转发的状态（见 --stream）")
+    parser.add_argument("--fleet-state", default=FLEET_STATE_NAME,
+                        help=f"发布机队状态的共享内存名字，默认 {FLEET_STATE_NAME}，传空字符串则不发布（workers 模式下仍使用匿名共享内存）")
+    parser.add_argument("--serve", type=int, default=0, metavar="PORT",
+                        help="在本机该TCP端口转发机队状态供其他监视端订阅，默认0不转发")
+    parser.add_argument("--serve-rate", type=float, default=10, help="转发频率（Hz），默认10")
+    parser.add_argument("--stream", default=f"127.0.0.1:{DEFAULT_STREAM_PORT}", metavar="HOST:PORT",
+                        help=f"stream 模式下订阅的地址，默认127.0.0.1:{DEFAULT_STREAM_PORT}")
+    parser.add_argument("--workers", type=int, default=None, help="workers 模式下的接收进程数，默认CPU核数减一")
+    parser.add_argument("--trail-budget", type=int, default=5000, help="每架无人机显示轨迹的最大点数，默认5000")
+    parser.add_argument("--fps", type=float, default=30, help="画面刷新的目标帧率，默认30")
+    parser.add_argument("--record", metavar="FILE", help="把收到的每条状态写入飞行记录目录 FILE（不支持 stream 模式）")
+    parser.add_argument("--replay", metavar="FILE", help="回放飞行记录目录 FILE，不监听UDP")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放倍速，默认1，0 表示尽可能快")
+    parser.add_argument("--benchmark", type=float, default=0, metavar="SECONDS",
+                        help="离屏运行指定秒数后汇报吞吐、丢包率、延迟与帧耗时，配合 load_generator.py 使用（不支持 stream 模式）")
+    parser.add_argument("--benchmark-json", metavar="FILE", help="把基准测试结果另存为 JSON 文件")
+    parser.add_argument("--metrics", metavar="FILE", help="定期把各无人机的丢包率、乱序数与抖动写入 JSON 文件")
+    parser.add_argument("--metrics-interval", type=float, default=5.0, help="写入统计文件的间隔（秒），默认5")
+    parser.add_argument("--lost-after", type=float, default=3.0, help="超过该秒数未收到数据显示为失联（置灰），默认3")
+    parser.add_argument("--evict-after", type=float, default=60.0, help="超过该秒数未收到数据则移除该无人机，0 表示不移除，默认60")
+    parser.add_argument("--max-trail-points", type=int, default=2_000_000, help="所有无人机保留的轨迹点总数上限，默认2000000")
     args = parser.parse_args()
+    retention = {"lost_after": args.lost_after, "evict_after": args.evict_after,
+                 "max_trail_points": args.max_trail_points}
+
+    stream_host, _, stream_port = args.stream.rpartition(":")
 
-    monitoring(args.port)
+    if args.replay:
+        replaying(args.replay, args.speed, args.trail_budget, args.fps, retention)
+    else:
+        monitoring(args.port, args.ingest, args.trail_budget, args.fps, args.record,
+                   args.benchmark, args.benchmark_json, args.metrics, args.metrics_interval, retention,
+                   args.workers, args.fleet_state, args.serve, args.serve_rate, (stream_host, int(stream_port)))
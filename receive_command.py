@@ -1,27 +1,76 @@
+import os
 import socket
 import json
+import struct
 import argparse
 import sys
-from xml_file import save_command_to_xml
+from xml_file import save_command_to_xml, AuditWriter
+from command_ipc import COMMAND_SOCKET, CommandChannel
+from command_common import COMMAND_GROUP, in_target_set
+from command_codec import MAGIC, MAX_COMMAND_SIZE, decode_command
 import time
+from collections import OrderedDict
 
 # 接收配置
 LISTEN_IP = "0.0.0.0"  # 监听所有网卡
+# 记住最近处理过的指令 id，重传的指令只回确认不重复执行
+RECENT_COMMAND_IDS = 1024
+# 执行端（command_change.py）读取的指令目录；本地通道不可用时指令写到这里
+COMMAND_DIR = "./commands_xml"
+# 经本地通道交付的指令的 XML 留档目录
+AUDIT_DIR = "./commands_audit"
 
-def listening(port=9999):
+
+def join_group(sock, group=COMMAND_GROUP):
+    """加入组播指令通道；网卡不支持组播时仍可接收单播指令"""
+    try:
+        mreq = struct.pack("4s4s", socket.inet_aton(group), socket.inet_aton("0.0.0.0"))
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        print(f"已加入组播指令通道 {group}")
+    except OSError as e:
+        print(f"加入组播组 {group} 失败，只接收单播指令：{e}")
+
+
+def self_ip_towards(addr, cache={}):
+    """本机在地面站看来的 ip：优先使用 UAV_SELF_IP，否则取发往 addr 时使用的本机地址"""
+    if os.environ.get("UAV_SELF_IP"):
+        return os.environ["UAV_SELF_IP"]
+    if addr[0] not in cache:
+        probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            probe.connect(addr)
+            cache[addr[0]] = probe.getsockname()[0]
+        finally:
+            probe.close()
+    return cache[addr[0]]
+
+
+def listening(port=9999, group=COMMAND_GROUP, ipc_path=COMMAND_SOCKET, audit=False):
+    """
+    接收地面站指令：优先经本地通道 ipc_path 直接交给执行端，
+    执行端未启动时退回写 XML 文件；audit 为 True 时另在后台写 XML 留档
+    """
     print(f"监听UDP端口 {port} 中...（Ctrl+C 可退出）")
 
     try:
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # 允许同一主机上的多个接收端共用组播端口（如地面测试）
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         sock.bind((LISTEN_IP, port))
     except OSError as e:
         print(f"端口 {port} 无法绑定（可能已被占用）：{e}")
         sys.exit(1)
+    if group:
+        join_group(sock, group)
 
+    channel = CommandChannel(ipc_path) if ipc_path else None
+    auditor = AuditWriter(AUDIT_DIR) if audit else None
+    recent_ids = OrderedDict()
     while True:
         try:
-            data, addr = sock.recvfrom(4096)
-            data_de = data.decode()
+            data, addr = sock.recvfrom(MAX_COMMAND_SIZE)
+            # 二进制指令不能按文本解码
+            data_de = "" if data[:2] == MAGIC else data.decode()
             # 用于接收消息
             if data_de[:8] == "message ":
                 # 确认是否能够通信
@@ -34,15 +83,41 @@ def listening(port=9999):
             # 用于接收指令
             else:
                 try:
-                    out_dir = "./commands_xml"
+                    command = decode_command(data)
+                    command_id = command.get("id")
+                    ack = f"message command reached {command_id}"
+                    # 组播指令带目标集合，不在其中的直接忽略（不回复确认）
+                    if "targets" in command or "roster" in command:
+                        self_ip = self_ip_towards(addr)
+                        if not in_target_set(command, self_ip):
+                            continue
+                        command = {"name": command["name"], "params": dict(command.get("params") or {}, ip=self_ip),
+                                   "id": command_id}
+                        # 组播确认带上自己的 ip，多网卡时地面站仍能对上目标
+                        ack += f" {self_ip}"
                     print(f"\n收到来自 {addr} 的指令：")
-                    command = json.loads(data.decode())
+                    if command_id is not None and command_id in recent_ids:
+                        print(f"重复的指令 {command_id}，只回复确认")
+                        sock.sendto(ack.encode(), addr)
+                        continue
                     print("指令内容：", command)
-                    save_command_to_xml(out_dir, command)
-                    sock.sendto("message command reached".encode(), addr)
+                    if channel is not None and channel.send(command):
+                        if auditor is not None:
+                            auditor.submit(command)
+                    else:
+                        save_command_to_xml(COMMAND_DIR, command)
+                    if command_id is None:
+                        sock.sendto("message command reached".encode(), addr)
+                    else:
+                        recent_ids[command_id] = True
+                        if len(recent_ids) > RECENT_COMMAND_IDS:
+                            recent_ids.popitem(last=False)
+                        sock.sendto(ack.encode(), addr)
 
                 except json.JSONDecodeError:
                     print("解析失败：不是有效的JSON")
+                except ValueError as e:
+                    print(f"解析失败：{e}")
 
         except KeyboardInterrupt:
             print("\n接收器已退出")
@@ -50,12 +125,19 @@ def listening(port=9999):
         except Exception as e:
             print(f"异常: {e}")
     sock.close()
+    if channel is not None:
+        channel.close()
+    if auditor is not None:
+        auditor.close()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="程序运行指令")
     parser.add_argument("--port", type=int, default=9999, help="监听的UDP端口（默认10001）")
+    parser.add_argument("--group", default=COMMAND_GROUP, help=f"加入的组播指令通道，默认{COMMAND_GROUP}，传空字符串表示不加入")
+    parser.add_argument("--ipc", default=COMMAND_SOCKET, help=f"交给执行端的本地指令通道，默认{COMMAND_SOCKET}，传空字符串表示只写XML文件")
+    parser.add_argument("--audit", action="store_true", help=f"经本地通道交付的指令另在后台写XML留档到{AUDIT_DIR}")
     args = parser.parse_args()
 
     time.sleep(5)
-    listening(args.port)
\ No newline at end of file
+    listening(args.port, args.group, args.ipc, args.audit)
\ No newline at end of file
@@ -1,14 +1,20 @@
-import socket
+import re
 import json
+import math
 import shlex
 import argparse
+import concurrent.futures
 from dataclasses import dataclass, asdict
+from command_dispatcher import get_dispatcher
+from command_common import COMMAND_GROUP, parse_targets
+from dispatch_scheduler import get_scheduler
 
 
 @dataclass
 class Command:
     name: str
     params: dict = None
+    id: str = None  # 由分发器填写，机载端据此确认与去重
 
     def to_dict(self):
         return asdict(self)
@@ -16,6 +22,10 @@ class Command:
     def to_json(self):
         return json.dumps(asdict(self))
 
+    def summary(self):
+        """打印用：指令名与参数，不含 id（id 由分发器在每次发送时分配）"""
+        return json.dumps({"name": self.name, "params": self.params})
+
 def build_command_parser():
     parser = argparse.ArgumentParser(description="指令解析器")
     subparsers = parser.add_subparsers(dest="cmd", required=True)
@@ -61,46 +71,6 @@ def build_command_parser():
     return parser
 
 
-def send_command(cmd, port):
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    parser = build_command_parser()
-
-    args = shlex.split(cmd)
-    parsed = parser.parse_args(args)
-
-    try:
-        # 获取ip
-        param_dict = {k: v for k, v in vars(parsed).items() if k == "ip" and v is not None}
-        ip_value = param_dict.get("ip")
-        ip_list = [ip.strip("[]") for ip in ip_value.split(", ")]
-
-        # 获取command键值对
-        param_dict = {k: v for k, v in vars(parsed).items() if k != "cmd" and k != "ip" and v is not None}
-        command = Command(name=parsed.cmd, params=param_dict)
-
-        for ip in ip_list:
-            # if command.name == "go":
-            #     # 考虑路径文件可能比较大，单独对其传输
-            #     param_dict = {k: v for k, v in vars(parsed).items() if k != "cmd" and k != "ip" and k != "path" and v is not None}
-            #     new_command = Command(name=parsed.cmd, params=param_dict)
-            #     path_message = new_command.to_json()
-            #     sock.sendto(path_message.encode(), (ip, port))
-            #     send_data.send_path(command.params["path"], ip, port)
-            # else:
-            command.params["ip"] = ip
-            message = command.to_json()
-            sock.sendto(message.encode(), (ip, port))
-            print(f"已发送指令 {message} 给 {ip}\n")
-
-    except Exception as e:
-        print(f"发生错误: {e}")
-
-    sock.close()
-
-
-
-
-
 # 安全阈值设置（定点飞行的安全由黄子谦设置，设置最大飞行距离）
 start_min_alt = 5
 start_max_alt = 100
@@ -111,72 +81,201 @@ follow_max_alt = 3
 go_min_interval = 5
 go_max_interval = 30
 
-def go(ip, path, interval=10, port=9999):
-    if len(ip) != 0:
-        if interval >= go_min_interval and interval <= go_max_interval:
-            send_command(f"go --ip '{ip}' --path '{path}' --interval {interval}", port)
-        else:
-            print(f"时间间隔的范围为({go_min_interval}, {go_max_interval})，命令设置不符合要求！")
-    else:
-        print("请指定接收命令的无人机ip！")
+# 这些指令会取消发给同一无人机、尚在排队的定时发送（如错峰的 go）
+OVERRIDE_COMMANDS = ("back", "land", "release")
+
+# 各指令的参数及校验规则：(最小值, 最大值, 名称)，targets 为 ip 列表，path 为路径点数组
+COMMAND_SPECS = {
+    "start": {"alt": (start_min_alt, start_max_alt, "起飞抬升高度")},
+    "back": {"alt": (back_min_alt, back_max_alt, "返回抬升高度")},
+    "follow": {"follow_ip": "targets", "alt": (follow_min_alt, follow_max_alt, "跟随高差")},
+    "release": {},
+    "go": {"path": "path", "interval": (go_min_interval, go_max_interval, "时间间隔")},
+    "land": {},
+    "flytopoint": {"x": (None, None, "x坐标"), "y": (None, None, "y坐标"), "z": (None, None, "z坐标")},
+}
 
-def start(ip, alt, port=9999):
-    if len(ip) != 0:
-        if alt >= start_min_alt and alt <= start_max_alt:
-            send_command(f"start --ip '{ip}' --alt {alt} ", port)
+
+def _parse_number(value, low, high, label):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{label}应为数字，收到 {value!r}")
+    if not math.isfinite(number):
+        raise ValueError(f"{label}应为有限的数字，收到 {value!r}")
+    if (low is not None and number < low) or (high is not None and number > high):
+        raise ValueError(f"{label}的范围为({low}, {high})，命令设置不符合要求！")
+    return number
+
+
+def _parse_path(path):
+    """路径为 [x1, y1, z1, x2, y2, z2, ...]，也接受同样内容的字符串"""
+    if isinstance(path, str):
+        path = [item for item in re.split(r"[\s,\[\]]+", path) if item]
+    points = [_parse_number(value, None, None, "路径坐标") for value in path]
+    if not points or len(points) % 3 != 0:
+        raise ValueError(f"路径点数应为3的倍数且不为空，收到 {len(points)} 个数")
+    return points
+
+
+def build_command(name, **params):
+    """按 COMMAND_SPECS 校验参数并构造 Command，参数不合法时抛出 ValueError"""
+    spec = COMMAND_SPECS.get(name)
+    if spec is None:
+        raise ValueError(f"未知指令：{name}")
+    unknown = set(params) - set(spec)
+    if unknown:
+        raise ValueError(f"指令 {name} 不支持参数：{', '.join(sorted(unknown))}")
+    checked = {}
+    for key, rule in spec.items():
+        if key not in params or params[key] is None:
+            raise ValueError(f"指令 {name} 缺少参数：{key}")
+        value = params[key]
+        if rule == "targets":
+            # 机载端按 ", " 分隔读取
+            checked[key] = ", ".join(parse_targets(value))
+        elif rule == "path":
+            checked[key] = _parse_path(value)
+        else:
+            checked[key] = _parse_number(value, *rule)
+    return Command(name=name, params=checked)
+
+
+def format_report(outcomes, name=None, cancelled=0):
+    """把各架无人机的 DispatchOutcome 整理为送达报告文本"""
+    outcomes = list(outcomes)
+    acked = [o for o in outcomes if o.status == "acked"]
+    lines = [f"指令 {name or outcomes[0].name} 送达 {len(acked)}/{len(outcomes) + cancelled} 架无人机"
+             + (f"，{cancelled} 架已取消发送" if cancelled else "")]
+    for o in outcomes:
+        if o.status == "acked":
+            lines.append(f"  {o.ip:<16} 已确认  RTT {o.rtt * 1000:.1f} ms  发送 {o.attempts} 次")
         else:
-            print(f"起飞抬升高度的范围为({start_min_alt}, {start_max_alt})，命令设置不符合要求！")
+            lines.append(f"  {o.ip:<16} {'超时未确认' if o.status == 'timeout' else '发送失败'}  "
+                         f"发送 {o.attempts} 次{'  ' + o.error if o.error else ''}")
+    return "\n".join(lines)
+
+
+def wait_report(futures, timeout=None):
+    """等待所有目标的送达结果，返回 {ip: DispatchOutcome}（已取消发送的不在其中）"""
+    concurrent.futures.wait(list(futures.values()), timeout)
+    return {ip: future.result(0) for ip, future in futures.items() if not future.cancelled()}
+
+
+def dispatch(name, ip, port=9999, report=True, multicast=False, **params):
+    """
+    类型化指令接口：校验参数、构造 Command 并交给后台分发器并发发送给 ip 中的每架无人机，
+    立即返回 {ip: Future}（结果为 DispatchOutcome，含确认状态与 RTT）。
+    multicast 为 True 时只发一个组播数据报，机载端按其中的目标集合执行。
+    go 指令按 interval 错峰，由后台定时队列依次发送；back/land/release 会取消同一无人机排队中的发送。
+    report 为 True 时所有目标都有结果后打印一次送达报告。参数不合法时抛出 ValueError
+    """
+    command = build_command(name, **params)
+    targets = parse_targets(ip)
+    if name in OVERRIDE_COMMANDS and get_scheduler(create=False) is not None:
+        for entry in get_scheduler().cancel(targets):
+            print(f"已取消排队中的 {entry.command.name} -> {entry.ip}")
+    if name == "go":
+        entries = get_scheduler().stagger(command, targets, command.params["interval"], port)
+        futures = {entry.ip: entry.future for entry in entries}
+        print(f"已排队指令 {command.summary()}，每隔 {command.params['interval']:g} 秒依次发给: {', '.join(targets)}\n")
     else:
-        print("请指定接收命令的无人机ip！")
+        # 单播时每架无人机的指令参数中带上各自的 ip，由分发器编码；组播时由机载端填入
+        futures = get_dispatcher().submit(command, targets, port, multicast)
+        print(f"已{'组播' if multicast else '发送'}指令 {command.summary()} 给 {len(targets)} 架无人机: {', '.join(targets)}\n")
+    if report:
+        remaining = [len(futures)]
 
+        def on_done(_):
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                done = [f.result() for f in futures.values() if not f.cancelled()]
+                cancelled = len(futures) - len(done)
+                print("\n" + format_report(done, name, cancelled))
 
+        for future in futures.values():
+            future.add_done_callback(on_done)
+    return futures
 
-def back(ip, alt, port=9999):
-    if len(ip) != 0:
-        if alt >= back_min_alt and alt <= back_max_alt:
-            send_command(f"back --ip '{ip}' --alt {alt} ", port)
-        else:
-            print(f"返回抬升高度的范围为({back_min_alt}, {back_max_alt})，命令设置不符合要求！")
-    else:
-        print("请指定接收命令的无人机ip！")
 
-def release(ip, port=9999):
-    if len(ip) != 0:
-        send_command(f"release --ip '{ip}'", port)
-    else:
-        print("请指定接收命令的无人机ip！")
+def send_command(cmd, port):
+    """命令行字符串接口：解析后交给 dispatch，返回 {ip: Future}"""
+    parser = build_command_parser()
 
+    args = shlex.split(cmd)
+    parsed = parser.parse_args(args)
 
-def follow(ip, follow_ip, alt, port=9999):
-    if len(ip) != 0:
-        if alt >= follow_min_alt and alt <= follow_max_alt:
-            send_command(f"follow --ip '{ip}' --follow_ip '{follow_ip}' --alt {alt}", port)
-        else:
-            print(f"跟随高差的范围为({follow_min_alt}, {follow_max_alt})，命令设置不符合要求！")
-    else:
-        print("请指定接收命令的无人机ip！")
+    try:
+        params = {k: v for k, v in vars(parsed).items() if k != "cmd" and k != "ip" and v is not None}
+        return dispatch(parsed.cmd, parsed.ip, port, **params)
+    except Exception as e:
+        print(f"发生错误: {e}")
 
-def land(ip, port=9999):
-    if len(ip) != 0:
-        send_command(f"land --ip '{ip}'", port)
-    else:
-        print("请指定接收命令的无人机ip！")
 
+def _dispatch_checked(name, ip, port, multicast=False, **params):
+    """控制台辅助函数共用：参数不合法时打印原因而不抛出"""
+    try:
+        dispatch(name, ip, port, multicast=multicast, **params)
+    except ValueError as e:
+        print(e)
 
-def flytopoint(ip, x, y, z, port=9999):
-    if len(ip) != 0:
-        send_command(f"flytopoint --ip '{ip}' --x {x} --y {y} --z {z}", port)
-    else:
-        print("请指定接收命令的无人机ip！")
+def go(ip, path, interval=10, port=9999):
+    _dispatch_checked("go", ip, port, path=path, interval=interval)
+
+def start(ip, alt, port=9999, multicast=False):
+    _dispatch_checked("start", ip, port, multicast, alt=alt)
+
+def back(ip, alt, port=9999, multicast=False):
+    _dispatch_checked("back", ip, port, multicast, alt=alt)
+
+def release(ip, port=9999, multicast=False):
+    _dispatch_checked("release", ip, port, multicast)
+
+def follow(ip, follow_ip, alt, port=9999, multicast=False):
+    _dispatch_checked("follow", ip, port, multicast, follow_ip=follow_ip, alt=alt)
+
+def land(ip, port=9999, multicast=False):
+    _dispatch_checked("land", ip, port, multicast)
+
+def flytopoint(ip, x, y, z, port=9999, multicast=False):
+    _dispatch_checked("flytopoint", ip, port, multicast, x=x, y=y, z=z)
+
+def pending():
+    """打印后台定时队列中尚未发送的指令"""
+    scheduler = get_scheduler(create=False)
+    entries = scheduler.queue() if scheduler is not None else []
+    if not entries:
+        print("没有排队中的指令")
+    for entry in entries:
+        print(f"{entry.remaining:6.1f} 秒后  {entry.command.name:<10} -> {entry.ip}")
+
+def cancel(ip=None):
+    """取消发给 ip（默认全部）的排队中的指令"""
+    scheduler = get_scheduler(create=False)
+    entries = scheduler.cancel(None if ip is None else parse_targets(ip)) if scheduler is not None else []
+    print(f"已取消 {len(entries)} 条排队中的指令")
+
+def reschedule(ip, delay):
+    """把发给 ip 的排队中的指令改为 delay 秒后发送"""
+    scheduler = get_scheduler(create=False)
+    entries = []
+    if scheduler is not None:
+        for target in parse_targets(ip):
+            entries += scheduler.reschedule(target, delay)
+    print(f"已重新安排 {len(entries)} 条排队中的指令")
+
+def use_codec(codec):
+    """切换之后指令的编码：json（默认，兼容旧机载端）或 binary（机载端需为新版）"""
+    try:
+        get_dispatcher(codec)
+        print(f"之后的指令使用 {codec} 编码")
+    except ValueError as e:
+        print(e)
 
-def send_message(ip_list, message, port=9999):
+def send_message(ip_list, message, port=9999, multicast=False):
     message = "message " + message
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    for ip in ip_list:
-        sock.sendto(message.encode(), (ip, port))
-        print(f"已发送指令 {message} 给 {ip}\n")
-
-    sock.close()
+    get_dispatcher().send_raw(message.encode(), [COMMAND_GROUP] if multicast else ip_list, port)
+    print(f"已{'组播' if multicast else '发送'}消息 {message} 给 {len(ip_list)} 架无人机\n")
 
 # 帮助
 def command_help():
@@ -195,7 +294,7 @@ def command_help():
     print("   所有指定ip的无人机立即悬停，解除任务")
 
     print("5. go(ip, path, interval=10, port=9999)")
-    print("   所有指定ip的无人机按顺序飞行路径path([x1, y1, z1, x2, y2, z2,...])，发送指令给不同无人机的时间间隔为interval(s)")
+    print("   所有指定ip的无人机按顺序飞行路径path([x1, y1, z1, x2, y2, z2,...])，发送指令给不同无人机的时间间隔为interval(s)，在后台排队发送，不阻塞控制台")
 
     print("6. land(ip, port=9999)")
     print("   所有指定ip的无人机立即着陆")
@@ -206,6 +305,21 @@ def command_help():
     print("8. ip = search(port = 9999, timeout = 1)")
     print("   搜索所有正在监听的无人机，返回ip列表")
 
+    print("9. show_fleet()")
+    print("   打印监视端共享内存中所有无人机的最新位置、电量与数据时间（需先运行monitorUAV.py）")
+
+    print("10. pos = where(ip)")
+    print("   返回指定ip无人机的最新位置(x, y, z)，界面坐标系下z轴向上")
+
+    print("11. pending() / cancel(ip=None) / reschedule(ip, delay)")
+    print("   查看、取消或推迟后台排队中的错峰指令（go）；back、land、release 会自动取消同一无人机排队中的指令")
+
+    print("12. use_codec(codec)")
+    print("   切换指令编码：json（默认，兼容旧机载端）或 binary（更紧凑，机载端需运行新版receive_command.py）")
+
+    print("start/back/release/follow/land/flytopoint 以及 send_message 可加 multicast=True：")
+    print("   只发一个组播数据报，所有机载端同时收到并按目标集合执行（机载端需运行新版receive_command.py）")
+
     print("注意：局部坐标系下，z轴垂直地面向下。")
 
 # if __name__ == "__main__":
@@ -2,6 +2,9 @@
 #include <vector>
 #include <string>
 #include <cstring>      // for memset
+#include <cstdint>
+#include <chrono>
+#include <fstream>
 #include <arpa/inet.h>  // for inet_addr, sockaddr_in (on Linux)
 #include <sys/socket.h> // for socket functions
 #include <unistd.h>     // for close()
@@ -12,20 +15,42 @@ struct UAV_info {
     float battery = 0;
 };
 
-// 发送信息（组装字符串并广播）
-void send_info(const UAV_info& info, int port) {
-    std::string head = "state";
-    std::string message = head + " " +
-                          std::to_string(info.pos[0]) + " " + std::to_string(info.pos[1]) + " " + std::to_string(info.pos[2]) + " " +
-                          std::to_string(info.q[0]) + " " + std::to_string(info.q[1]) + " " + std::to_string(info.q[2]) + " " +
-                          std::to_string(info.q[3]) + " " +
-                          std::to_string(info.battery);
+// 二进制状态包（小端、紧凑排列，共 52 字节），与 telemetry.py 中的 STATE_DTYPE 对应：
+//   magic u32 | version u8 | flags u8 | drone_id u16 | seq u32 | timestamp f64 |
+//   pos 3*f32 | quat 4*f32 (w, x, y, z) | battery f32
+const uint8_t STATE_MAGIC[4] = {'U', 'A', 'V', 'S'};
+const uint8_t STATE_VERSION = 1;
+const size_t STATE_PACKET_SIZE = 52;
+
+static_assert(__BYTE_ORDER__ == __ORDER_LITTLE_ENDIAN__, "状态包按小端编码，当前平台需要增加字节序转换");
+static_assert(sizeof(float) == 4 && sizeof(double) == 8, "状态包要求 IEEE754 的 float/double");
+
+// 按二进制格式编码一条状态，buf 至少 STATE_PACKET_SIZE 字节，返回写入的字节数
+size_t encode_state(const UAV_info& info, uint16_t drone_id, uint32_t seq, double timestamp, uint8_t* buf) {
+    size_t offset = 0;
+    auto put = [&](const void* data, size_t size) {
+        std::memcpy(buf + offset, data, size);
+        offset += size;
+    };
+    uint8_t flags = 0;
+    put(STATE_MAGIC, 4);
+    put(&STATE_VERSION, 1);
+    put(&flags, 1);
+    put(&drone_id, 2);
+    put(&seq, 4);
+    put(&timestamp, 8);
+    put(info.pos, 3 * sizeof(float));
+    put(info.q, 4 * sizeof(float));
+    put(&info.battery, sizeof(float));
+    return offset;
+}
 
-    // 发送广播
+// 广播一段数据到指定端口
+bool broadcast(const void* data, size_t size, int port) {
     int sock = socket(AF_INET, SOCK_DGRAM, IPPROTO_UDP);
     if (sock < 0) {
         std::cerr << "创建UDP socket失败！\n";
-        return;
+        return false;
     }
 
     // 设置 socket 为可广播
@@ -33,7 +58,7 @@ void send_info(const UAV_info& info, int port) {
     if (setsockopt(sock, SOL_SOCKET, SO_BROADCAST, (char *)&broadcastEnable, sizeof(broadcastEnable)) < 0) {
         std::cerr << "设置广播选项失败！\n";
         close(sock);
-        return;
+        return false;
     }
 
     sockaddr_in addr;
@@ -42,25 +67,69 @@ void send_info(const UAV_info& info, int port) {
     inet_pton(AF_INET, "192.168.1.255", &(addr.sin_addr));
     // addr.sin_addr.s_addr = inet_addr("10.101.121.255"); // 通信地址地址
 
-    ssize_t sent = sendto(sock, message.c_str(), message.size(), 0,
+    ssize_t sent = sendto(sock, data, size, 0,
                           reinterpret_cast<sockaddr*>(&addr), sizeof(addr));
+    close(sock);
     if (sent < 0) {
         std::cerr << "广播发送失败！\n";
-    } else {
+        return false;
+    }
+    return true;
+}
+
+// 发送信息（组装字符串并广播），旧机型使用的文本格式
+void send_info(const UAV_info& info, int port) {
+    std::string head = "state";
+    std::string message = head + " " +
+                          std::to_string(info.pos[0]) + " " + std::to_string(info.pos[1]) + " " + std::to_string(info.pos[2]) + " " +
+                          std::to_string(info.q[0]) + " " + std::to_string(info.q[1]) + " " + std::to_string(info.q[2]) + " " +
+                          std::to_string(info.q[3]) + " " +
+                          std::to_string(info.battery);
+
+    if (broadcast(message.c_str(), message.size(), port)) {
         std::cout << "已广播指令 \"" << message << "\" 到端口 " << port << "\n";
     }
+}
 
-    close(sock);
+// 每个 drone_id 的 seq 保存在文件中，程序每次运行都从上次的值继续递增，
+// 监视端的序号跟踪不会把后续的包当作重复包丢弃（文件丢失时从 0 开始，监视端按时间戳识别为重启）
+uint32_t next_seq(uint16_t drone_id) {
+    std::string path = "/tmp/uav_state_seq_" + std::to_string(drone_id);
+    uint32_t seq = 0;
+    std::ifstream in(path);
+    if (in >> seq) {
+        ++seq;
+    }
+    in.close();
+    std::ofstream out(path, std::ios::trunc);
+    out << seq;
+    return seq;
+}
+
+// 发送二进制状态包，seq 由 next_seq 按发送者持久递增
+void send_state(const UAV_info& info, uint16_t drone_id, int port) {
+    uint32_t seq = next_seq(drone_id);
+    uint8_t buf[STATE_PACKET_SIZE];
+    double timestamp = std::chrono::duration<double>(
+        std::chrono::system_clock::now().time_since_epoch()).count();
+    size_t size = encode_state(info, drone_id, seq, timestamp, buf);
+    if (broadcast(buf, size, port)) {
+        std::cout << "已广播状态包 id=" << drone_id << " seq=" << seq << " 到端口 " << port << "\n";
+    }
 }
 
-int main() {
+int main(int argc, char* argv[]) {
     UAV_info uav{{1, 2, -3}, {0, 1, 0, 0}, 50};
     int port = 10003;
-    send_info(uav, port);
+    // 传入 --text 时使用旧的文本格式
+    if (argc > 1 && std::string(argv[1]) == "--text") {
+        send_info(uav, port);
+    } else {
+        send_state(uav, 1, port);
+    }
     return 0;
 }
 
-
 // #include <iostream>
 // #include <string>
 // #include <cstring>
@@ -15,6 +15,12 @@ from send_command import land
 from send_command import flytopoint
 from send_command import send_message
 from send_command import command_help
+from send_command import pending
+from send_command import cancel
+from send_command import reschedule
+from send_command import use_codec
+from fleet_state import show_fleet
+from fleet_state import where
 
 import os
 paths = os.environ.get('PYTHONPATH', '').split(':')
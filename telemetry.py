@@ -0,0 +1,467 @@
+import socket
+import select
+import threading
+import time
+import math
+from collections import namedtuple, deque
+import numpy as np
+
+# 批量接收模式下，每个定时周期最多读取的数据报数量（防止洪泛时界面卡死）
+MAX_DRAIN_PER_TICK = 4096
+# 接收缓冲区大小（字节），适当调大以容纳两次读取之间的突发数据
+RECV_BUFFER_SIZE = 4 * 1024 * 1024
+# 最新状态表最多保存的无人机数量
+MAX_TABLE_ENTRIES = 4096
+
+
+# 二进制状态包（小端、紧凑排列，共 52 字节），与 send_info.cpp 中的 encode_state 对应：
+#   magic u32 | version u8 | flags u8 | drone_id u16 | seq u32 | timestamp f64 |
+#   pos 3*f32 | quat 4*f32 (w, x, y, z) | battery f32
+STATE_MAGIC = b"UAVS"
+STATE_VERSION = 1
+STATE_DTYPE = np.dtype([
+    ("magic", "<u4"),
+    ("version", "u1"),
+    ("flags", "u1"),
+    ("drone_id", "<u2"),
+    ("seq", "<u4"),
+    ("timestamp", "<f8"),
+    ("pos", "<f4", (3,)),
+    ("quat", "<f4", (4,)),
+    ("battery", "<f4"),
+])
+_MAGIC_VALUE = int.from_bytes(STATE_MAGIC, "little")
+
+
+class TelemetryState(namedtuple("TelemetryState", "pos quat battery drone_id seq timestamp")):
+    """
+    一条解析后的状态：pos (1, 3)、quat (1, 4)、battery，
+    以及二进制包携带的 drone_id、seq、timestamp（文本格式分别为 0、-1、nan）
+    """
+    __slots__ = ()
+
+
+def encode_state(pos, quat, battery, drone_id=0, seq=0, timestamp=None):
+    """按二进制格式编码一条状态（pos 为机体发送的原始坐标，z 轴向下）"""
+    packet = np.zeros(1, dtype=STATE_DTYPE)
+    packet["magic"] = _MAGIC_VALUE
+    packet["version"] = STATE_VERSION
+    packet["drone_id"] = drone_id
+    packet["seq"] = seq
+    packet["timestamp"] = time.time() if timestamp is None else timestamp
+    packet["pos"] = pos
+    packet["quat"] = quat
+    packet["battery"] = battery
+    return packet.tobytes()
+
+
+def encode_states(pos, quat, battery, drone_ids, seq, timestamp=None):
+    """批量编码 N 条状态：各参数为长度 N 的数组（或可广播的标量），返回 N 个数据包"""
+    n = len(drone_ids)
+    packets = np.zeros(n, dtype=STATE_DTYPE)
+    packets["magic"] = _MAGIC_VALUE
+    packets["version"] = STATE_VERSION
+    packets["drone_id"] = drone_ids
+    packets["seq"] = seq
+    packets["timestamp"] = time.time() if timestamp is None else timestamp
+    packets["pos"] = pos
+    packets["quat"] = quat
+    packets["battery"] = battery
+    buf = packets.tobytes()
+    size = STATE_DTYPE.itemsize
+    return [buf[i * size:(i + 1) * size] for i in range(n)]
+
+
+def decode_states(datagrams):
+    """
+    批量解析二进制状态包：一次 np.frombuffer 得到结构化数组。
+    返回 (records, index)，index 为 datagrams 中被识别为二进制状态包的下标
+    """
+    index = [i for i, data in enumerate(datagrams)
+             if len(data) == STATE_DTYPE.itemsize and data[:4] == STATE_MAGIC]
+    if not index:
+        return np.empty(0, dtype=STATE_DTYPE), index
+    records = np.frombuffer(b"".join(datagrams[i] for i in index), dtype=STATE_DTYPE)
+    # 只接受本程序能识别的版本
+    valid = records["version"] == STATE_VERSION
+    if not valid.all():
+        records = records[valid]
+        index = [i for i, ok in zip(index, valid) if ok]
+    return records, index
+
+
+def _record_to_state(record):
+    pos = record["pos"].astype(float).reshape(1, 3)
+    pos[0, 2] = -pos[0, 2]
+    return TelemetryState(pos, record["quat"].astype(float).reshape(1, 4), float(record["battery"]),
+                          int(record["drone_id"]), int(record["seq"]), float(record["timestamp"]))
+
+
+def parse_text_state(data):
+    """
+    解析一条文本状态消息：state x y z qw qx qy qz battery（兼容旧机型）
+    若不是状态消息则返回 None
+    """
+    message = data.decode().split()
+    if not message or message[0] != "state":
+        return None
+    pos = np.array([float(message[1]), float(message[2]), -float(message[3])]).reshape(1, 3)
+    quat = np.array([float(message[4]), float(message[5]), float(message[6]), float(message[7])]).reshape(1, 4)
+    battery = float(message[8])
+    return TelemetryState(pos, quat, battery, 0, -1, float("nan"))
+
+
+def parse_state(data):
+    """解析一条状态消息（二进制或文本），返回 TelemetryState，若不是状态消息则返回 None"""
+    if data[:4] == STATE_MAGIC:
+        records, index = decode_states([data])
+        return _record_to_state(records[0]) if index else None
+    return parse_text_state(data)
+
+
+def parse_datagrams(datagrams):
+    """
+    解析一批 (data, addr)：二进制包批量解析，文本包逐条解析。
+    返回 [(ip, TelemetryState)]，保持接收顺序
+    """
+    states = [None] * len(datagrams)
+    records, index = decode_states([data for data, _ in datagrams])
+    for i, record in zip(index, records):
+        states[i] = _record_to_state(record)
+    binary = set(index)
+    for i, (data, _) in enumerate(datagrams):
+        if i in binary:
+            continue
+        try:
+            states[i] = parse_text_state(data)
+        except Exception as e:
+            print(f"解析异常: {e}")
+    return [(addr[0], state) for (_, addr), state in zip(datagrams, states) if state is not None]
+
+
+def drain_socket(sock, max_count=MAX_DRAIN_PER_TICK, recorder=None, tracker=None, fleet_state=None):
+    """
+    读空非阻塞 socket 中所有待处理的数据报，每架无人机只保留最新状态
+    tracker 不为空时先按 seq 丢弃重复和迟到的状态；
+    recorder 不为空时，合并前的每条状态都会写入飞行记录；
+    fleet_state 不为空时同时写入共享内存状态表（分区 0），并回收其中过期的行
+    返回 (latest, drained, dropped)：
+        latest: {ip: TelemetryState}
+        drained: 本次读取的数据报数量
+        dropped: 被同一无人机更新状态覆盖而丢弃的数量
+    """
+    datagrams = []
+    while len(datagrams) < max_count:
+        try:
+            datagrams.append(sock.recvfrom(4096))
+        except (BlockingIOError, InterruptedError):
+            break
+    latest = {}
+    dropped = 0
+    for ip, state in parse_datagrams(datagrams):
+        if tracker is not None and not tracker.accept(ip, state):
+            continue
+        if recorder is not None:
+            recorder.append(ip, state)
+        if fleet_state is not None:
+            fleet_state.publish(0, ip, state, tracker.stats(ip) if tracker else None, time.time())
+        if ip in latest:
+            dropped += 1
+        latest[ip] = state
+    if fleet_state is not None:
+        fleet_state.expire(0)
+    return latest, len(datagrams), dropped
+
+
+# seq 为 u32，按模 2^32 比较先后
+SEQ_MOD = 1 << 32
+# 滑动窗口宽度：窗口内的迟到包可判断是否重复
+SEQ_WINDOW = 64
+# 序号回退但时间戳比已接受的最新状态更新，说明无人机重启、序号重新开始；
+# 没有时间戳的状态落后超过该值才视为重启（需连续两包确认）
+MAX_MISORDER = 1000
+
+
+class SequenceStats:
+    """单架无人机的序号统计，占用固定内存"""
+    __slots__ = ("base", "highest", "timestamp", "window", "received", "accepted", "duplicates",
+                 "reordered", "restarts", "jitter", "_transit", "_probation")
+
+    def __init__(self, seq, timestamp=float("nan")):
+        self.base = seq        # 统计起点
+        self.highest = seq     # 已接受的最大序号（展开后，不回绕）
+        self.timestamp = timestamp  # 最大序号状态的发送时间戳
+        self.window = 1        # 最近 SEQ_WINDOW 个序号的到达位图，最低位为 highest
+        self.received = 1      # 收到的不重复状态数（含迟到的）
+        self.accepted = 1      # 按序接受并送入界面的状态数
+        self.duplicates = 0
+        self.reordered = 0     # 迟到而被丢弃的状态数
+        self.restarts = 0
+        self.jitter = 0.0      # RFC 3550 到达间隔抖动（秒）
+        self._transit = None
+        self._probation = None
+
+    @property
+    def expected(self):
+        return self.highest - self.base + 1
+
+    @property
+    def lost(self):
+        return max(self.expected - self.received, 0)
+
+    @property
+    def loss_rate(self):
+        return self.lost / self.expected
+
+    def as_dict(self):
+        return {"expected": self.expected, "received": self.received, "accepted": self.accepted,
+                "lost": self.lost, "loss_rate": round(self.loss_rate, 6), "duplicates": self.duplicates,
+                "reordered": self.reordered, "restarts": self.restarts,
+                "jitter_ms": round(self.jitter * 1000, 3)}
+
+
+class SequenceTracker:
+    """
+    按无人机跟踪二进制状态包的 seq：重复和乱序（迟到）的状态被丢弃，
+    同时统计丢包率、乱序数与 RFC 3550 到达抖动。每架无人机内存占用固定。
+    文本格式的状态没有 seq，一律放行。
+    """
+    def __init__(self):
+        self._stats = {}
+
+    def accept(self, ip, state, recv_time=None):
+        """返回该状态是否应送入界面"""
+        if state.seq < 0:
+            return True
+        if recv_time is None:
+            recv_time = time.time()
+        stats = self._stats.get(ip)
+        if stats is None:
+            self._stats[ip] = stats = SequenceStats(state.seq, state.timestamp)
+            self._update_jitter(stats, state, recv_time)
+            return True
+
+        delta = (state.seq - stats.highest) % SEQ_MOD
+        if (delta == 0 or delta >= SEQ_MOD // 2) and state.timestamp > stats.timestamp:
+            # 序号没有前进但状态更新：无人机重启，从新序号重新统计（NaN 比较恒为 False）
+            self._restart(ip, stats, state, recv_time)
+            return True
+        if delta == 0:
+            stats.duplicates += 1
+            return False
+        if delta < SEQ_MOD // 2 and state.timestamp < stats.timestamp:
+            # 序号前进但时间戳更早：重启之前发出的迟到状态，属于旧的序号空间，不计入统计
+            stats.reordered += 1
+            return False
+        if delta < SEQ_MOD // 2:
+            # 更新的状态：窗口前移
+            stats.highest += delta
+            stats.window = ((stats.window << delta) | 1) & ((1 << SEQ_WINDOW) - 1) if delta < SEQ_WINDOW else 1
+            stats.received += 1
+            stats.accepted += 1
+            stats.timestamp = state.timestamp
+            stats._probation = None
+            self._update_jitter(stats, state, recv_time)
+            return True
+
+        behind = SEQ_MOD - delta
+        if behind > MAX_MISORDER and math.isnan(state.timestamp):
+            # 没有时间戳可判断：差距过大时可能是无人机重启，连续两包确认后从新序号重新统计
+            if stats._probation == state.seq:
+                self._restart(ip, stats, state, recv_time)
+                return True
+            stats._probation = (state.seq + 1) % SEQ_MOD
+            stats.reordered += 1
+            return False
+        if behind < SEQ_WINDOW and stats.highest - behind >= stats.base:
+            # 统计起点之前的序号不计入收到数
+            bit = 1 << behind
+            if stats.window & bit:
+                stats.duplicates += 1
+                return False
+            stats.window |= bit
+            stats.received += 1
+        # 迟到的状态已过时，不再送入界面，避免标记往回跳
+        stats.reordered += 1
+        return False
+
+    def _restart(self, ip, stats, state, recv_time):
+        self._stats[ip] = fresh = SequenceStats(state.seq, state.timestamp)
+        fresh.restarts = stats.restarts + 1
+        self._update_jitter(fresh, state, recv_time)
+
+    @staticmethod
+    def _update_jitter(stats, state, recv_time):
+        if math.isnan(state.timestamp):
+            return
+        transit = recv_time - state.timestamp
+        if stats._transit is not None:
+            stats.jitter += (abs(transit - stats._transit) - stats.jitter) / 16
+        stats._transit = transit
+
+    def forget(self, ip):
+        """无人机被移除后丢弃其统计，重新出现时从头统计"""
+        self._stats.pop(ip, None)
+
+    def stats(self, ip):
+        """返回某架无人机的 SequenceStats，没有带 seq 的状态时返回 None"""
+        return self._stats.get(ip)
+
+    def snapshot(self):
+        """所有无人机的统计 {ip: dict}，用于导出指标"""
+        return {ip: stats.as_dict() for ip, stats in list(self._stats.items())}
+
+    def totals(self):
+        """全机队汇总的统计"""
+        entries = list(self._stats.values())
+        expected = sum(s.expected for s in entries)
+        received = sum(s.received for s in entries)
+        return {"drones": len(entries), "expected": expected, "received": received,
+                "lost": sum(s.lost for s in entries),
+                "loss_rate": round(1 - received / expected, 6) if expected else None,
+                "duplicates": sum(s.duplicates for s in entries),
+                "reordered": sum(s.reordered for s in entries)}
+
+
+def receive_batch(sock, max_count=MAX_DRAIN_PER_TICK):
+    """
+    阻塞读取一条数据报（超时抛出 socket.timeout），
+    然后把已经到达的数据报一并读出，返回 [(data, addr)] 供批量解析
+    """
+    datagrams = [sock.recvfrom(4096)]
+    while len(datagrams) < max_count and select.select([sock], [], [], 0)[0]:
+        datagrams.append(sock.recvfrom(4096))
+    return datagrams
+
+
+class LatestStateTable:
+    """
+    每架无人机只保存最新状态的表，接收线程写入，界面线程按自己的节奏取走。
+    锁只保护一次字典赋值或交换，临界区极短，不会阻塞接收。
+    """
+    def __init__(self, max_entries=MAX_TABLE_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._states = {}
+        self._packets = {}    # 上次取走以来每架无人机收到的状态数
+        self.received = 0     # 写入的状态总数
+        self.overwritten = 0  # 未被取走就被新状态覆盖的数量
+        self.rejected = 0     # 超出容量被拒绝的数量
+
+    def put(self, ip, state):
+        with self._lock:
+            self.received += 1
+            if ip in self._states:
+                self.overwritten += 1
+            elif len(self._states) >= self.max_entries:
+                self.rejected += 1
+                return
+            self._states[ip] = state
+            self._packets[ip] = self._packets.get(ip, 0) + 1
+
+    def take(self):
+        """取走自上次调用以来所有更新过的无人机状态 {ip: state}"""
+        with self._lock:
+            states, self._states = self._states, {}
+            self._packets = {}
+        return states
+
+    def take_counted(self):
+        """同 take，另外返回每架无人机在此期间收到的状态数 {ip: count}"""
+        with self._lock:
+            states, self._states = self._states, {}
+            packets, self._packets = self._packets, {}
+        return states, packets
+
+    def take_counters(self):
+        """取走并清零统计计数 (received, overwritten, rejected)"""
+        with self._lock:
+            counters = (self.received, self.overwritten, self.rejected)
+            self.received = self.overwritten = self.rejected = 0
+        return counters
+
+
+class TelemetryReceiver(threading.Thread):
+    """独立的遥测接收线程：阻塞读取 socket，解析状态消息后写入最新状态表"""
+    def __init__(self, sock, table, poll_timeout=0.2, recorder=None, tracker=None, fleet_state=None):
+        super().__init__(daemon=True, name="TelemetryReceiver")
+        self.sock = sock
+        self.table = table
+        # 飞行记录器、序号跟踪与共享状态表（分区 0）只在本线程中写入
+        self.recorder = recorder
+        self.tracker = tracker
+        self.fleet_state = fleet_state
+        # 阻塞读取的超时时间，仅用于定期检查退出标志
+        self.sock.settimeout(poll_timeout)
+        self._stop_event = threading.Event()
+        self.parse_errors = 0
+
+    def run(self):
+        while not self._stop_event.is_set():
+            if self.fleet_state is not None:
+                self.fleet_state.expire(0)
+            try:
+                datagrams = receive_batch(self.sock)
+            except socket.timeout:
+                continue
+            except OSError as e:
+                if not self._stop_event.is_set():
+                    print(f"接收异常: {e}")
+                break
+            try:
+                states = parse_datagrams(datagrams)
+            except Exception as e:
+                self.parse_errors += 1
+                print(f"解析异常: {e}")
+                continue
+            for ip, state in states:
+                if self.tracker is not None and not self.tracker.accept(ip, state):
+                    continue
+                if self.recorder is not None:
+                    self.recorder.append(ip, state)
+                if self.fleet_state is not None:
+                    stats = self.tracker.stats(ip) if self.tracker is not None else None
+                    self.fleet_state.publish(0, ip, state, stats, time.time())
+                self.table.put(ip, state)
+
+    def stop(self, timeout=1.0):
+        self._stop_event.set()
+        self.join(timeout)
+
+
+class IngestProbe:
+    """
+    接收统计探针：与飞行记录器接口相同（append），挂在接收路径上，
+    按 seq 统计每架无人机的丢包，按包内时间戳统计接收延迟。
+    recorder 不为空时把状态继续转交给飞行记录器。
+    """
+    def __init__(self, recorder=None, max_samples=100000):
+        self.recorder = recorder
+        self.received = 0
+        self._seq = {}  # ip -> [第一个 seq, 最大 seq, 收到的带 seq 状态数]
+        self.latency = deque(maxlen=max_samples)  # 接收延迟样本（秒）
+
+    def append(self, ip, state):
+        if self.recorder is not None:
+            self.recorder.append(ip, state)
+        self.received += 1
+        if state.seq >= 0:
+            entry = self._seq.get(ip)
+            if entry is None:
+                self._seq[ip] = [state.seq, state.seq, 1]
+            else:
+                entry[1] = max(entry[1], state.seq)
+                entry[2] += 1
+        if not math.isnan(state.timestamp):
+            self.latency.append(time.time() - state.timestamp)
+
+    def loss(self):
+        """返回 (应收数, 实收数)，由各无人机 seq 的范围推算"""
+        entries = list(self._seq.values())
+        expected = sum(last - first + 1 for first, last, _ in entries)
+        received = sum(count for _, _, count in entries)
+        return expected, received
+
+    @property
+    def drones(self):
+        return len(self._seq)
@@ -0,0 +1,43 @@
+import numpy as np
+from telemetry import TelemetryState, SequenceTracker
+
+IP = "192.168.1.10"
+
+
+def make_state(seq, timestamp):
+    return TelemetryState(np.zeros((1, 3)), np.array([[1.0, 0.0, 0.0, 0.0]]), 100.0, 1, seq, timestamp)
+
+
+def test_restart_detected_by_timestamp():
+    tracker = SequenceTracker()
+    assert tracker.accept(IP, make_state(500, 10.0), 10.0)
+    assert tracker.accept(IP, make_state(501, 10.1), 10.1)
+    # 重启后序号从 0 开始，时间戳更新
+    assert tracker.accept(IP, make_state(0, 20.0), 20.0)
+    assert tracker.stats(IP).restarts == 1
+    assert tracker.stats(IP).base == 0
+
+
+def test_late_pre_restart_state_rejected_after_restart():
+    tracker = SequenceTracker()
+    assert tracker.accept(IP, make_state(0, 10.0), 10.0)
+    assert tracker.accept(IP, make_state(1, 10.1), 10.1)
+    assert tracker.accept(IP, make_state(0, 20.0), 20.0)
+    assert tracker.accept(IP, make_state(1, 20.1), 20.1)
+    # 重启前发出的状态迟到：序号看起来在前进，但时间戳更早，不能覆盖显示的状态
+    assert not tracker.accept(IP, make_state(2, 10.2), 20.2)
+    stats = tracker.stats(IP)
+    assert stats.highest == 1
+    assert stats.received == 2
+    assert stats.reordered == 1
+    # 之后重启后的正常状态照常接受
+    assert tracker.accept(IP, make_state(2, 20.2), 20.3)
+
+
+def test_states_without_timestamp_still_advance():
+    tracker = SequenceTracker()
+    nan = float("nan")
+    assert tracker.accept(IP, make_state(0, nan), 1.0)
+    assert tracker.accept(IP, make_state(1, nan), 1.1)
+    assert not tracker.accept(IP, make_state(1, nan), 1.2)
+    assert tracker.stats(IP).duplicates == 1
@@ -0,0 +1,125 @@
+import numpy as np
+
+
+# 显示轨迹的最小点数预算
+MIN_TRAIL_BUDGET = 4
+
+
+class TrajectoryBuffer:
+    """
+    预分配、容量倍增的轨迹缓冲区。
+    追加一个点均摊 O(1)，view() 返回已写入部分的零拷贝视图。
+    默认 float64，保存与导出的全分辨率历史不丢精度。
+    """
+    def __init__(self, capacity=256, dtype=np.float64):
+        self._data = np.empty((max(int(capacity), 1), 3), dtype=dtype)
+        self._count = 0
+        # 每次重新分配底层数组时加一，渲染端据此判断是否需要整体重新上传
+        self.generation = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def capacity(self):
+        return self._data.shape[0]
+
+    @property
+    def buffer(self):
+        """整个底层数组（包括尚未写入的部分），供显存按容量分配"""
+        return self._data
+
+    def append(self, point):
+        if self._count == self._data.shape[0]:
+            self._grow(2 * self._data.shape[0])
+        self._data[self._count] = point
+        self._count += 1
+
+    def _grow(self, capacity):
+        data = np.empty((capacity, 3), dtype=self._data.dtype)
+        data[:self._count] = self._data[:self._count]
+        self._data = data
+        self.generation += 1
+
+    def view(self):
+        return self._data[:self._count]
+
+    def last(self, n=1):
+        """最近 n 个点的视图"""
+        return self._data[max(self._count - n, 0):self._count]
+
+    def trim(self, keep):
+        """只保留最近 keep 个点；底层数组留出一半余量，截断后继续追加不会立即扩容"""
+        keep = max(int(keep), 1)
+        if self._count <= keep:
+            return
+        capacity = keep + keep // 2 + 1
+        if self._data.shape[0] > capacity:
+            data = np.empty((capacity, 3), dtype=self._data.dtype)
+            data[:keep] = self._data[self._count - keep:self._count]
+            self._data = data
+        else:
+            self._data[:keep] = self._data[self._count - keep:self._count]
+        self._count = keep
+        self.generation += 1
+
+
+class DecimatedTrail:
+    """
+    有显示点数预算的轨迹，用于渲染（全分辨率历史仍保存在 TrajectoryBuffer 中）。
+    数组即显存上传的来源，默认 float32，追加时由 float64 转换。
+    数组分为两段：[较旧航段（步长 stride 抽稀） | 最近航段（全分辨率）]
+    - 新点距上一个保留点小于 min_step 时丢弃（按距离抽稀）
+    - 点数达到预算时，把最近航段较旧的一半按 stride 抽稀后并入较旧航段；
+      较旧航段超过预算一半时整体隔点抽掉，stride 加倍，保证整段历史均匀稀疏
+    每次抽稀花费 O(budget)，至少间隔 budget/4 次追加才发生一次，因此每个新点均摊 O(1)。
+    """
+    def __init__(self, budget=5000, min_step=0.05, dtype=np.float32):
+        self.budget = max(int(budget), MIN_TRAIL_BUDGET)
+        self.min_step = float(min_step)
+        self._data = np.empty((self.budget, 3), dtype=dtype)
+        self._count = 0
+        self._older = 0   # 较旧航段的点数
+        self.stride = 1   # 较旧航段相对于保留点的抽稀步长
+        self._phase = 0   # 下一段开始采样的位置
+        # 每次抽稀重排数组时加一，渲染端据此判断是否需要整体重新上传
+        self.generation = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def buffer(self):
+        return self._data
+
+    def view(self):
+        return self._data[:self._count]
+
+    def append(self, point):
+        """追加一个点，返回是否被保留"""
+        if self._count > 0:
+            delta = self._data[self._count - 1] - point
+            if delta[0] * delta[0] + delta[1] * delta[1] + delta[2] * delta[2] < self.min_step * self.min_step:
+                return False
+        if self._count == self.budget:
+            self._compact()
+        self._data[self._count] = point
+        self._count += 1
+        return True
+
+    def _compact(self):
+        move = (self._count - self._older) // 2
+        # 按 stride 采样时延续上一段的相位，保证较旧航段间隔均匀
+        sampled = self._data[self._older + self._phase:self._older + move:self.stride]
+        self._phase = self._phase + len(sampled) * self.stride - move
+        older = np.concatenate((self._data[:self._older], sampled))
+        while len(older) >= self.budget // 2:
+            older = older[::2]
+            self.stride *= 2
+        self._phase %= self.stride
+        recent = self._data[self._older + move:self._count].copy()
+        self._data[:len(older)] = older
+        self._data[len(older):len(older) + len(recent)] = recent
+        self._older = len(older)
+        self._count = len(older) + len(recent)
+        self.generation += 1
@@ -70,7 +70,7 @@
 
 import numpy as np
 from pyqtgraph.opengl import GLMeshItem, MeshData
-from pyqtgraph.Qt import QtGui
+from pyqtgraph.Qt import QtGui, QtCore
 
 def rodrigues_rotation_matrix(axis, angle):
     """
@@ -94,6 +94,73 @@ def rodrigues_rotation_matrix(axis, angle):
     ], dtype=float)
     return R
 
+def alignment_matrices(directions):
+    """
+    批量计算将本地 +Y 对齐到各目标方向的旋转矩阵。
+    directions: (N, 3) 方向向量；返回 (N, 3, 3)，方向近零时为单位矩阵
+    """
+    directions = np.asarray(directions, dtype=float).reshape(-1, 3)
+    n = len(directions)
+    norm = np.linalg.norm(directions, axis=1)
+    valid = norm >= 1e-8
+    t = np.zeros_like(directions)
+    t[valid] = directions[valid] / norm[valid, None]
+
+    # v = (0,1,0) × t = (tz, 0, -tx)，c = (0,1,0)·t = ty
+    # R = I + [v]x + [v]x² / (1 + c)
+    c = t[:, 1]
+    K = np.zeros((n, 3, 3))
+    K[:, 0, 1] = t[:, 0]
+    K[:, 1, 0] = -t[:, 0]
+    K[:, 1, 2] = -t[:, 2]
+    K[:, 2, 1] = t[:, 2]
+    R = np.broadcast_to(np.eye(3), (n, 3, 3)).copy()
+    # 与 +Y 反向时 1 + c 趋于 0，单独处理为绕 Z 轴旋转 180 度
+    opposite = c <= -1.0 + 1e-8
+    regular = valid & ~opposite
+    R[regular] += K[regular] + (K[regular] @ K[regular]) / (1.0 + c[regular])[:, None, None]
+    R[valid & opposite] = np.diag([-1.0, -1.0, 1.0])
+    return R
+
+def roll_matrices(axes, angles):
+    """
+    批量 Rodrigues：绕各自单位轴 axes (N, 3) 旋转 angles (N,) 弧度，返回 (N, 3, 3)
+    """
+    axes = np.asarray(axes, dtype=float).reshape(-1, 3)
+    angles = np.asarray(angles, dtype=float).reshape(-1)
+    x, y, z = axes[:, 0], axes[:, 1], axes[:, 2]
+    c = np.cos(angles)
+    s = np.sin(angles)
+    C = 1 - c
+    R = np.empty((len(axes), 3, 3))
+    R[:, 0, 0] = c + x*x*C
+    R[:, 0, 1] = x*y*C - z*s
+    R[:, 0, 2] = x*z*C + y*s
+    R[:, 1, 0] = y*x*C + z*s
+    R[:, 1, 1] = c + y*y*C
+    R[:, 1, 2] = y*z*C - x*s
+    R[:, 2, 0] = z*x*C - y*s
+    R[:, 2, 1] = z*y*C + x*s
+    R[:, 2, 2] = c + z*z*C
+    return R
+
+def batch_transforms(positions, align, rolls):
+    """
+    一次性构造所有标记的 4x4 变换矩阵：先对齐（align，(N, 3, 3)），再绕中轴滚转 rolls，最后平移到 positions。
+    中轴为对齐后的本地 +Y，即 align[:, :, 1]。返回 (N, 4, 4)
+    """
+    positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+    n = len(positions)
+    mats = np.zeros((n, 4, 4))
+    mats[:, :3, :3] = roll_matrices(align[:, :, 1], rolls) @ align
+    mats[:, :3, 3] = positions
+    mats[:, 3, 3] = 1.0
+    return mats
+
+def to_qmatrix(mat):
+    """将 4x4 数组一次性转换为 QMatrix4x4（按行优先）"""
+    return QtGui.QMatrix4x4(np.asarray(mat, dtype=float).ravel().tolist())
+
 class Triangle3D(GLMeshItem):
     def __init__(self, pos, direction, length=0.4, width=0.1, color=(1, 0, 0, 1), roll=0.0, smooth=False):
         """
@@ -111,6 +178,8 @@ class Triangle3D(GLMeshItem):
         self.length = float(length)
         self.width = float(width)
         self.roll = float(roll)
+        # 对齐矩阵只在方向改变时重新计算
+        self.R_align = alignment_matrices(self.direction)[0]
 
         # 构造本地三角形网格：底边中心在 (0,0,0)，尖头在 (0, length, 0)
         verts = np.array([
@@ -127,71 +196,131 @@ class Triangle3D(GLMeshItem):
 
     def update_transform(self):
         """
-        计算旋转矩阵将本地 +Y 对齐到目标 direction，再绕中轴滚转 roll，
+        用缓存的对齐矩阵（本地 +Y 对齐到 direction）再绕中轴滚转 roll，
         然后将底边中心平移到 pos，构造并应用 4x4 变换矩阵。
         """
-        # 1. 归一化目标方向
-        dir_vec = np.array(self.direction, dtype=float)
-        norm = np.linalg.norm(dir_vec)
-        if norm < 1e-8:
-            # 方向近零：视为不旋转，本地 +Y 保持
-            R_align = np.eye(3)
-        else:
-            v_local = np.array([0.0, 1.0, 0.0], dtype=float)
-            v_target = dir_vec / norm
-            # 计算 dot 和 axis
-            dot = np.dot(v_local, v_target)
-            if dot >= 1.0 - 1e-8:
-                # 同向，无旋转
-                R_align = np.eye(3)
-            elif dot <= -1.0 + 1e-8:
-                # 反向，旋转180度，选任意垂直轴
-                # 例如选本地 X 轴 [1,0,0]，若 v_local 近似 [±1,0,0] 则改用 [0,0,1]
-                arbitrary = np.array([1.0, 0.0, 0.0], dtype=float)
-                if abs(np.dot(v_local, arbitrary)) > 0.9:
-                    arbitrary = np.array([0.0, 0.0, 1.0], dtype=float)
-                axis = np.cross(v_local, arbitrary)
-                axis /= np.linalg.norm(axis)
-                R_align = rodrigues_rotation_matrix(axis, np.pi)
-            else:
-                axis = np.cross(v_local, v_target)
-                axis_norm = np.linalg.norm(axis)
-                axis /= axis_norm
-                angle = np.arccos(dot)
-                R_align = rodrigues_rotation_matrix(axis, angle)
-
-        # 2. 如果有 roll，需要在对齐后绕对齐轴滚转
-        if abs(self.roll) < 1e-8 or norm < 1e-8:
-            R_total = R_align
-        else:
-            # 对齐后中轴方向 = v_target
-            axis = dir_vec / norm
-            R_roll = rodrigues_rotation_matrix(axis, self.roll)
-            # 先对齐，再滚转：R_total = R_roll @ R_align
-            R_total = R_roll @ R_align
-
-        # 3. 构造 4x4 变换矩阵
-        mat = QtGui.QMatrix4x4()
-        # 填充旋转部分
-        for i in range(3):
-            for j in range(3):
-                mat[i, j] = R_total[i, j]
-        # 填充平移部分：本地原点(0,0,0)映射到世界 pos
-        mat[0, 3] = self.pos[0]
-        mat[1, 3] = self.pos[1]
-        mat[2, 3] = self.pos[2]
-
-        # 应用
-        self.setTransform(mat)
+        mat = batch_transforms(self.pos, self.R_align[None], np.array([self.roll]))[0]
+        self.setTransform(to_qmatrix(mat))
 
     def set_position(self, pos):
         self.pos = np.array(pos, dtype=float)
         self.update_transform()
 
     def set_direction(self, direction):
-        self.direction = np.array(direction, dtype=float)
+        direction = np.array(direction, dtype=float)
+        if not np.array_equal(direction, self.direction):
+            self.direction = direction
+            self.R_align = alignment_matrices(direction)[0]
         self.update_transform()
 
     def set_roll(self, roll):
         self.roll = float(roll)
         self.update_transform()
+
+class TriangleFleet(GLMeshItem):
+    """
+    所有无人机的朝向标记共用一个图元：共享同一个本地三角形网格，
+    逐实例的位置、方向、滚转角和颜色保存在 NumPy 数组中，
+    刷新时批量计算全部变换并一次绘制，绘制开销不随无人机数量增加而增加调用次数。
+    """
+    def __init__(self, length=0.4, width=0.1, capacity=16, auto_refresh=True):
+        self.length = float(length)
+        self.width = float(width)
+        # 本地三角形：底边中心在 (0,0,0)，尖头在 (0, length, 0)
+        self.local_verts = np.array([
+            [0.0, self.length, 0.0],
+            [-self.width/2.0, 0.0, 0.0],
+            [ self.width/2.0, 0.0, 0.0]
+        ], dtype=float)
+
+        capacity = max(int(capacity), 1)
+        self.marker_positions = np.zeros((capacity, 3))
+        self.marker_directions = np.zeros((capacity, 3))
+        self.marker_align = np.broadcast_to(np.eye(3), (capacity, 3, 3)).copy()
+        self.marker_rolls = np.zeros(capacity)
+        self.marker_colors = np.ones((capacity, 4))
+        self.marker_active = np.zeros(capacity, dtype=bool)
+        self._count = 0       # 已使用过的最大实例编号 + 1
+        self._free = []
+        # auto_refresh 为 False 时由调用方（如帧调度器）在 dirty 时显式调用 refresh
+        self.auto_refresh = auto_refresh
+        self.dirty = False
+        self._refresh_pending = False
+
+        super().__init__(smooth=False, shader='shaded', drawEdges=False)
+        self.setVisible(False)
+
+    def _grow(self):
+        capacity = 2 * len(self.marker_active)
+        for name in ('marker_positions', 'marker_directions', 'marker_align', 'marker_rolls', 'marker_colors', 'marker_active'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def add_marker(self, pos, direction, color, roll=0.0):
+        """新增一个标记，返回实例编号"""
+        if self._free:
+            index = self._free.pop()
+        else:
+            if self._count == len(self.marker_active):
+                self._grow()
+            index = self._count
+            self._count += 1
+        self.marker_active[index] = True
+        self.marker_positions[index] = pos
+        self.marker_directions[index] = direction
+        self.marker_align[index] = alignment_matrices(direction)[0]
+        self.marker_rolls[index] = roll
+        self.marker_colors[index] = color
+        self._changed()
+        return index
+
+    def remove_marker(self, index):
+        self.marker_active[index] = False
+        self._free.append(index)
+        self._changed()
+
+    def set_position(self, index, pos):
+        self.marker_positions[index] = pos
+        self._changed()
+
+    def set_direction(self, index, direction):
+        direction = np.asarray(direction, dtype=float)
+        # 方向不变时沿用缓存的对齐矩阵
+        if not np.array_equal(direction, self.marker_directions[index]):
+            self.marker_directions[index] = direction
+            self.marker_align[index] = alignment_matrices(direction)[0]
+            self._changed()
+
+    def set_roll(self, index, roll):
+        self.marker_rolls[index] = roll
+        self._changed()
+
+    def set_color(self, index, color):
+        self.marker_colors[index] = color
+        self._changed()
+
+    def _changed(self):
+        self.dirty = True
+        if self.auto_refresh:
+            self.schedule_refresh()
+
+    def schedule_refresh(self):
+        """合并同一轮事件循环中的多次修改，只重建一次网格"""
+        if not self._refresh_pending:
+            self._refresh_pending = True
+            QtCore.QTimer.singleShot(0, self.refresh)
+
+    def refresh(self):
+        self._refresh_pending = False
+        self.dirty = False
+        indices = np.flatnonzero(self.marker_active[:self._count])
+        if len(indices) == 0:
+            self.setVisible(False)
+            return
+        mats = batch_transforms(self.marker_positions[indices], self.marker_align[indices], self.marker_rolls[indices])
+        # (N, 3, 3)：每个实例的三个顶点在世界坐标中的位置
+        verts = np.einsum('nij,vj->nvi', mats[:, :3, :3], self.local_verts) + mats[:, None, :3, 3]
+        self.setMeshData(vertexes=verts, faceColors=self.marker_colors[indices])
+        self.setVisible(True)
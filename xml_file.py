@@ -1,7 +1,25 @@
 import os
+import re
+import queue
+import threading
 import xml.etree.ElementTree as ET
 from datetime import datetime
 
+# 文件名开头的序号，command_change 按它决定处理顺序；每个目录在首次写入时从已有文件的最大序号继续
+_SEQUENCE_PATTERN = re.compile(r"^(\d+)_")
+_sequences = {}
+_sequence_lock = threading.Lock()
+
+
+def next_sequence(out_dir):
+    with _sequence_lock:
+        if out_dir not in _sequences:
+            existing = [int(m.group(1)) for m in map(_SEQUENCE_PATTERN.match, os.listdir(out_dir)) if m]
+            _sequences[out_dir] = max(existing, default=0)
+        _sequences[out_dir] += 1
+        return _sequences[out_dir]
+
+
 def save_command_to_xml(out_dir, command_dict):
     # 创建保存目录
     os.makedirs(out_dir, exist_ok=True)
@@ -18,9 +36,10 @@ def save_command_to_xml(out_dir, command_dict):
         param_elem = ET.SubElement(params_elem, key)
         param_elem.text = str(value)
 
-    # 自动生成文件名
+    # 自动生成文件名：序号_指令_时间，同一秒内的多条指令也不会重名
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{cmd_name}_{timestamp}.xml.part"
+    stem = f"{next_sequence(out_dir):08d}_{cmd_name}_{timestamp}"
+    filename = f"{stem}.xml.part"
     filepath = os.path.join(out_dir, filename)
 
     try:
@@ -30,7 +49,7 @@ def save_command_to_xml(out_dir, command_dict):
         print(f"写入XML文件失败: {e}")
         return
 
-    new_filename = f"{cmd_name}_{timestamp}.xml"
+    new_filename = f"{stem}.xml"
     new_filepath = os.path.join(out_dir, new_filename)
     try:
         os.replace(filepath, new_filepath)  # 原子替换，更安全
@@ -38,4 +57,28 @@ def save_command_to_xml(out_dir, command_dict):
         print(f"重命名文件失败: {e}")
         return
 
-    print(f"已保存XML指令: {new_filepath}")
\ No newline at end of file
+    print(f"已保存XML指令: {new_filepath}")
+
+
+class AuditWriter:
+    """在后台线程中把指令写成 XML 留档，不占用接收循环的时间"""
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="AuditWriter")
+        self.thread.start()
+
+    def submit(self, command):
+        self.queue.put(command)
+
+    def _run(self):
+        while True:
+            command = self.queue.get()
+            if command is None:
+                return
+            save_command_to_xml(self.out_dir, command)
+
+    def close(self):
+        """写完队列中剩余的指令后退出"""
+        self.queue.put(None)
+        self.thread.join()